@@ -0,0 +1,138 @@
+# band_executor.py
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+# Shared-memory blocks attached by this (worker) process, keyed by name
+_attached = {}
+_MAX_ATTACHED = 16
+
+
+def _attach(descriptor):
+    """
+    Maps a shared-memory array described by (name, shape, dtype) into this process.
+
+    :param descriptor: Tuple (name, shape, dtype string).
+    :return: NumPy array backed by the shared block.
+    """
+    name, shape, dtype = descriptor
+    if name not in _attached:
+        # The creating process owns (and unlinks) the block; do not track it here where possible
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+        while len(_attached) > _MAX_ATTACHED:
+            old_shm, _ = _attached.pop(next(iter(_attached)))
+            old_shm.close()
+    return _attached[name][1]
+
+
+def _run_task(args):
+    """
+    Runs one task in a worker process with its shared arrays attached.
+
+    :param args: Tuple (func, descriptors, task).
+    :return: Result of func.
+    """
+    func, descriptors, task = args
+    arrays = {key: _attach(descriptor) for key, descriptor in descriptors.items()}
+    return func(**arrays, **task)
+
+
+class BandExecutor:
+    def __init__(self, workers=1, backend='thread'):
+        """
+        Initializes the BandExecutor.
+
+        Runs independent tasks (typically bands of macroblock rows) on a thread or process pool.
+        Large arrays are passed to process workers through shared memory instead of being
+        pickled with every task; within a session() each array is shared only once.
+
+        :param workers: Number of workers; 1 runs every task in the calling thread.
+        :param backend: 'thread' or 'process'.
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor backend '{backend}'. Use 'thread' or 'process'.")
+        self.workers = max(1, int(workers))
+        self.backend = backend
+        self._pool = None
+        self._session = None
+
+    @staticmethod
+    def split(count, parts):
+        """
+        Splits range(count) into at most `parts` contiguous, nearly equal (start, stop) ranges.
+
+        :param count: Number of items.
+        :param parts: Number of ranges.
+        :return: List of (start, stop) tuples.
+        """
+        bounds = np.linspace(0, count, min(parts, max(count, 1)) + 1).astype(int)
+        return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    def map(self, func, shared, tasks):
+        """
+        Calls func(**shared, **task) for every task and returns the results in task order.
+
+        :param func: Module-level function (it must be picklable for the process backend).
+        :param shared: Dict of large NumPy arrays passed to every task.
+        :param tasks: List of dicts with the per-task keyword arguments.
+        :return: List of results.
+        """
+        if self.workers == 1 or len(tasks) <= 1:
+            return [func(**shared, **task) for task in tasks]
+        if self._pool is None:
+            pool_class = ThreadPoolExecutor if self.backend == 'thread' else ProcessPoolExecutor
+            self._pool = pool_class(max_workers=self.workers)
+        if self.backend == 'thread':
+            futures = [self._pool.submit(func, **shared, **task) for task in tasks]
+            return [future.result() for future in futures]
+
+        with self.session():
+            descriptors = {key: self._share(array) for key, array in shared.items()}
+            return list(self._pool.map(_run_task, [(func, descriptors, task) for task in tasks]))
+
+    @contextmanager
+    def session(self):
+        """
+        Keeps arrays shared with process workers alive until the outermost session ends, so an
+        array used by several map() calls is copied to shared memory only once.
+        """
+        if self._session is not None:
+            yield
+            return
+        self._session = {}
+        try:
+            yield
+        finally:
+            for shm, _, _ in self._session.values():
+                shm.close()
+                shm.unlink()
+            self._session = None
+
+    def _share(self, array):
+        """
+        Copies an array into a shared-memory block (once per session).
+
+        :param array: NumPy array.
+        :return: Descriptor (name, shape, dtype string).
+        """
+        key = id(array)
+        if key not in self._session:
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            # Keep the source array alive so its id() is not reused during the session
+            self._session[key] = (shm, (shm.name, array.shape, array.dtype.str), array)
+        return self._session[key][1]
+
+    def close(self):
+        """
+        Shuts down the worker pool.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
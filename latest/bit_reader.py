@@ -0,0 +1,131 @@
+# bit_reader.py
+
+import numpy as np
+
+
+class BitReader:
+    def __init__(self, data, position=0):
+        """
+        Initializes the BitReader.
+
+        Reads bits most significant first, as BitWriter writes them. The next bits wait in an
+        integer window that is refilled several bytes at a time, so most reads are a shift and
+        a mask. Reading past the end of the data yields zero bits, so a decoder may peek
+        further than the last code.
+
+        :param data: bytes (or bytearray) to read.
+        :param position: Bit position to start at.
+        """
+        self._data = bytes(data)
+        self.position = position
+
+    def __len__(self):
+        """
+        Returns the number of bits in the data.
+        """
+        return len(self._data) * 8
+
+    @property
+    def position(self):
+        """
+        Bit position of the next bit to read.
+        """
+        return self._next * 8 - self._available
+
+    @position.setter
+    def position(self, position):
+        self._next = position >> 3
+        self._window = 0
+        self._available = 0
+        self.skip(position & 7)
+
+    def _refill(self, count):
+        """
+        Loads whole bytes into the window until it holds at least `count` bits.
+
+        :param count: Number of bits needed.
+        """
+        length = max((count - self._available + 7) >> 3, 8)
+        chunk = self._data[self._next:self._next + length]
+        value = int.from_bytes(chunk, 'big') << (8 * (length - len(chunk)))
+        self._window = ((self._window & ((1 << self._available) - 1)) << (8 * length)) | value
+        self._next += length
+        self._available += 8 * length
+
+    def peek(self, count):
+        """
+        Returns the next `count` bits as an integer without consuming them.
+
+        :param count: Number of bits.
+        :return: Integer.
+        """
+        if self._available < count:
+            self._refill(count)
+        return (self._window >> (self._available - count)) & ((1 << count) - 1)
+
+    def read(self, count):
+        """
+        Consumes the next `count` bits.
+
+        :param count: Number of bits.
+        :return: Integer.
+        """
+        if self._available < count:
+            self._refill(count)
+        self._available -= count
+        return (self._window >> self._available) & ((1 << count) - 1)
+
+    def skip(self, count):
+        """
+        Consumes `count` bits without reading them.
+
+        :param count: Number of bits.
+        """
+        if self._available < count:
+            self._refill(count)
+        self._available -= count
+
+    def read_exp_golomb(self, count, signed=False):
+        """
+        Consumes `count` Exp-Golomb codes (the inverse of BitWriter.write_exp_golomb).
+
+        :param count: Number of values.
+        :param signed: The values were written signed.
+        :return: int64 array (count,).
+        """
+        values = np.empty(count, dtype=np.int64)
+        for index in range(count):
+            zeros = 0
+            window = self.peek(32)
+            while not window:
+                self.skip(32)
+                zeros += 32
+                window = self.peek(32)
+            leading = 32 - window.bit_length()
+            self.skip(leading)
+            values[index] = self.read(zeros + leading + 1) - 1
+        if signed:
+            values = np.where(values & 1, (values + 1) >> 1, -(values >> 1))
+        return values
+
+    def read_array(self, count, width):
+        """
+        Consumes `count` fixed-width values at once (the inverse of BitWriter.write_array with
+        a single length).
+
+        :param count: Number of values.
+        :param width: Bits per value.
+        :return: int64 array (count,).
+        """
+        total = count * width
+        position = self.position
+        start = position >> 3
+        end = (position + total + 7) >> 3
+        chunk = np.frombuffer(self._data[start:end], dtype=np.uint8)
+        bits = np.unpackbits(chunk)
+        if len(bits) < (end - start) * 8:
+            bits = np.concatenate([bits, np.zeros((end - start) * 8 - len(bits), dtype=np.uint8)])
+        offset = position - start * 8
+        self.position = position + total
+        bits = bits[offset:offset + total].reshape(count, width).astype(np.int64)
+        return bits @ (1 << np.arange(width - 1, -1, -1))
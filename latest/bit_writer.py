@@ -0,0 +1,124 @@
+# bit_writer.py
+
+import numpy as np
+
+
+class BitWriter:
+    def __init__(self):
+        """
+        Initializes the BitWriter.
+
+        Bits are appended most significant first. Whole bytes go to a growable bytearray; the
+        bits of the last, partial byte wait in an integer accumulator until it fills up.
+        """
+        self._buffer = bytearray()
+        self._accumulator = 0
+        self._pending = 0
+
+    def __len__(self):
+        """
+        Returns the number of bits written so far.
+        """
+        return len(self._buffer) * 8 + self._pending
+
+    def _flush(self):
+        """
+        Moves the whole bytes of the accumulator to the buffer.
+        """
+        whole = self._pending >> 3
+        if whole:
+            self._pending &= 7
+            self._buffer += (self._accumulator >> self._pending).to_bytes(whole, 'big')
+            self._accumulator &= (1 << self._pending) - 1
+
+    def write(self, value, length):
+        """
+        Appends the `length` low bits of a non-negative integer.
+
+        :param value: Integer.
+        :param length: Number of bits (0 writes nothing).
+        """
+        self._accumulator = (self._accumulator << length) | (value & ((1 << length) - 1))
+        self._pending += length
+        if self._pending >= 8:
+            self._flush()
+
+    def write_array(self, values, lengths):
+        """
+        Appends many values at once, packed with NumPy instead of one Python call per value.
+
+        Values of up to 32 bits are placed straight into big-endian 32-bit words: shifted into
+        a 64-bit window starting at its word, a value covers that word and maybe the next, and
+        since the bit fields of different values never overlap, adding up the halves per word
+        (np.bincount) is the same as OR-ing them in. Longer values are expanded to single bits
+        and packed with np.packbits.
+
+        :param values: Array of non-negative integers, each fitting in its bit length (at most 62).
+        :param lengths: Bit length of every value (array), or one length for all (integer).
+        """
+        values = np.asarray(values, dtype=np.int64).ravel()
+        lengths = np.broadcast_to(np.asarray(lengths, dtype=np.int64), values.shape).ravel()
+        if not len(values):
+            return
+        # Bit positions counted from the start of the partial byte
+        ends = np.cumsum(lengths) + self._pending
+        total = int(ends[-1])
+        if lengths.max() > 32:
+            bits = self._expand_bits(values, lengths, ends - self._pending)
+            head = (self._accumulator >> np.arange(self._pending - 1, -1, -1)) & 1
+            data = np.packbits(np.concatenate([head.astype(np.uint8), bits]))
+        else:
+            starts = ends - lengths
+            word = starts >> 5
+            placed = values.astype(np.uint64) << (64 - (starts & 31) - lengths).astype(np.uint64)
+            size = int(word[-1]) + 2
+            words = np.bincount(word, weights=(placed >> np.uint64(32)).astype(np.float64), minlength=size)
+            words += np.bincount(word + 1, weights=(placed & np.uint64(0xFFFFFFFF)).astype(np.float64), minlength=size)
+            words[0] += self._accumulator << (32 - self._pending)
+            data = words[:(total + 31) >> 5].astype(np.uint32).astype('>u4').view(np.uint8)
+        whole = total >> 3
+        self._buffer += data[:whole].tobytes()
+        self._pending = total & 7
+        self._accumulator = int(data[whole]) >> (8 - self._pending) if self._pending else 0
+
+    def write_exp_golomb(self, values, signed=False):
+        """
+        Appends many values as Exp-Golomb codes, as H.264 codes its side information (ue(v)
+        and se(v)): a value v is written as v + 1 in binary, preceded by one zero bit per bit
+        after its leading one, so small values take few bits and no table is needed.
+
+        :param values: Array of integers (non-negative unless signed).
+        :param signed: Map signed values to unsigned ones first: 1, -1, 2, -2, ... become 1, 2, 3, 4, ...
+        """
+        values = np.asarray(values, dtype=np.int64).ravel()
+        if signed:
+            values = np.where(values > 0, 2 * values - 1, -2 * values)
+        values = values + 1
+        # Bit length of v + 1 (exact below 2 ** 53)
+        bits = np.frexp(values.astype(np.float64))[1].astype(np.int64)
+        self.write_array(values, 2 * bits - 1)
+
+    @staticmethod
+    def _expand_bits(values, lengths, ends):
+        """
+        Expands values to one uint8 per bit, most significant first.
+
+        :param values: int64 array of values.
+        :param lengths: int64 array of bit lengths.
+        :param ends: Cumulative sum of the lengths.
+        :return: uint8 array of bits.
+        """
+        value = np.repeat(np.arange(len(values)), lengths)
+        # Bit of every output position, counted from the least significant bit of its value
+        shifts = ends[value] - 1 - np.arange(len(value))
+        return ((values[value] >> shifts) & 1).astype(np.uint8)
+
+    def getvalue(self):
+        """
+        Returns the bits written so far, with the last byte padded with zero bits.
+
+        :return: bytes.
+        """
+        if not self._pending:
+            return bytes(self._buffer)
+        return bytes(self._buffer) + bytes([self._accumulator << (8 - self._pending)])
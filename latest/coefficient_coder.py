@@ -0,0 +1,177 @@
+# coefficient_coder.py
+
+import numpy as np
+from huffman_coder import HuffmanCoder
+
+# Run-length symbols, as in JPEG: (run << 4) | size codes a run of up to 15 zeros followed by a
+# coefficient of `size` amplitude bits; EOB ends a block and ZRL codes a run of 16 zeros.
+EOB = 0x00
+ZRL = 0xF0
+MAX_SIZE = 15
+
+
+class CoefficientCoder:
+    # Zigzag scan orders by transform size
+    _zigzag = {}
+
+    @classmethod
+    def zigzag(cls, n):
+        """
+        Returns the zigzag scan order of an n x n block (computed once per size).
+
+        :param n: Transform size.
+        :return: int array (n * n,) of flat (row-major) indices in scan order.
+        """
+        if n not in cls._zigzag:
+            row, col = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+            diagonal = row + col
+            # Odd anti-diagonals run down-left, even ones up-right
+            key = diagonal * n + np.where(diagonal % 2 == 1, row, n - 1 - row)
+            order = np.argsort(key.ravel())
+            order.setflags(write=False)
+            cls._zigzag[n] = order
+        return cls._zigzag[n]
+
+    @classmethod
+    def scan(cls, blocks):
+        """
+        Reorders blocks to zigzag order with a single gather.
+
+        :param blocks: Array (N, n, n).
+        :return: Array (N, n * n).
+        """
+        n = blocks.shape[-1]
+        return blocks.reshape(len(blocks), n * n)[:, cls.zigzag(n)]
+
+    @classmethod
+    def unscan(cls, scanned, n):
+        """
+        Restores blocks from zigzag order (inverse of scan).
+
+        :param scanned: Array (N, n * n).
+        :param n: Transform size.
+        :return: Array (N, n, n).
+        """
+        blocks = np.empty_like(scanned)
+        blocks[:, cls.zigzag(n)] = scanned
+        return blocks.reshape(len(scanned), n, n)
+
+    @staticmethod
+    def run_length_encode(scanned):
+        """
+        Converts zigzag-ordered blocks to (run, level) symbols with an end-of-block marker.
+
+        All blocks are processed at once: the non-zero coefficients are located with one
+        np.nonzero call and the zero runs follow from the gaps between them.
+
+        :param scanned: Integer array (N, K) of quantized coefficients in zigzag order.
+        :return: Tuple (symbols, levels, blocks): uint8 symbols, int32 levels (0 for EOB and ZRL)
+                 and the block index of every symbol, in stream order.
+        """
+        count, length = scanned.shape
+        block, position = np.nonzero(scanned)
+        levels = scanned[block, position].astype(np.int32)
+        # Position of the previous non-zero coefficient of the same block (-1 for the first)
+        previous = np.r_[-1, position[:-1]]
+        previous[np.r_[True, block[1:] != block[:-1]][:len(block)]] = -1
+        runs = position - previous - 1
+        sizes = np.frexp(np.abs(levels).astype(np.float64))[1]
+        if sizes.size and sizes.max() > MAX_SIZE:
+            raise ValueError(f"Coefficient level {np.abs(levels).max()} does not fit in {MAX_SIZE} bits.")
+
+        # Items in stream order: the coefficients of every block, then its EOB. A coefficient
+        # item expands to run // 16 ZRL symbols followed by its (run % 16, size) symbol.
+        keys = np.concatenate([block * (length + 1) + position, np.arange(count) * (length + 1) + length])
+        order = np.argsort(keys, kind='stable')
+        weights = np.concatenate([runs // 16 + 1, np.ones(count, dtype=np.int64)])[order]
+        item_symbols = np.concatenate([((runs % 16) << 4) | sizes, np.full(count, EOB)])[order]
+        item_levels = np.concatenate([levels, np.zeros(count, dtype=np.int32)])[order]
+        item_blocks = np.concatenate([block, np.arange(count)])[order]
+
+        item = np.repeat(np.arange(len(weights)), weights)
+        offset = np.arange(len(item)) - (np.cumsum(weights) - weights)[item]
+        last = offset == weights[item] - 1
+        symbols = np.where(last, item_symbols[item], ZRL).astype(np.uint8)
+        return symbols, np.where(last, item_levels[item], 0).astype(np.int32), item_blocks[item]
+
+    @staticmethod
+    def run_length_decode(symbols, levels, count, length):
+        """
+        Rebuilds zigzag-ordered blocks from (run, level) symbols (inverse of run_length_encode).
+
+        :param symbols: uint8 symbols of `count` blocks in stream order.
+        :param levels: int32 levels of the symbols.
+        :param count: Number of blocks.
+        :param length: Coefficients per block.
+        :return: int32 array (count, length).
+        """
+        symbols = np.asarray(symbols, dtype=np.int64)
+        is_eob = symbols == EOB
+        # Block of every symbol: the number of EOBs before it
+        block = np.cumsum(is_eob) - is_eob
+        advance = np.where(symbols == ZRL, 16, np.where(is_eob, 0, (symbols >> 4) + 1))
+        total = np.cumsum(advance)
+        block_start = np.zeros(count + 1, dtype=np.int64)
+        ends = np.flatnonzero(is_eob)
+        block_start[1:len(ends) + 1] = total[ends]
+        position = total - block_start[block] - 1
+
+        coefficient = (symbols & 0x0F) != 0
+        scanned = np.zeros((count, length), dtype=np.int32)
+        scanned[block[coefficient], position[coefficient]] = levels[coefficient]
+        return scanned
+
+    @classmethod
+    def encode_symbols(cls, symbols, levels, writer, codes=None):
+        """
+        Huffman-codes the symbols followed by their amplitude bits.
+
+        :param symbols: uint8 symbols.
+        :param levels: int32 levels.
+        :param writer: BitWriter the codes are appended to.
+        :param codes: Dict symbol -> code to use (e.g. a table shared by several frames, see
+                      HuffmanTableCache); None builds a table for this stream.
+        :return: Dict symbol -> code ('0'/'1' string) of the table used.
+        """
+        if not len(symbols):
+            # Nothing to code, e.g. every macroblock of the frame was skipped
+            return {}
+        if codes is None:
+            # Canonical codes: the code lengths alone describe the table (see HuffmanCoder.serialize_table)
+            codes = HuffmanCoder.canonical_codes(HuffmanCoder.code_lengths(HuffmanCoder.build_frequency_dict(symbols)))
+        # Every symbol's code followed by its amplitude bits (negative levels in one's complement,
+        # as in JPEG) makes one value of at most 31 bits, and all of them are packed at once
+        values, lengths = HuffmanCoder.code_arrays(codes)
+        sizes = (symbols & 0x0F).astype(np.int64)
+        amplitudes = np.where(levels > 0, levels, levels + (1 << sizes) - 1)
+        writer.write_array((values[symbols] << sizes) | amplitudes, lengths[symbols] + sizes)
+        return codes
+
+    @classmethod
+    def decode_symbols(cls, reader, codes, count):
+        """
+        Reads symbols and levels until `count` blocks are complete (inverse of encode_symbols).
+
+        :param reader: BitReader positioned at the first code.
+        :param codes: Dict symbol -> code used by the encoder, or its decoder tables
+                      (HuffmanCoder.decoding_table, e.g. cached by HuffmanTableCache).
+        :param count: Number of blocks to read.
+        :return: Tuple (symbols, levels) as arrays.
+        """
+        if isinstance(codes, tuple):
+            table = codes
+        else:
+            table = HuffmanCoder.decoding_table({int(symbol): code for symbol, code in codes.items()})
+        symbols, levels = [], []
+        blocks = 0
+        while blocks < count:
+            symbol = HuffmanCoder.read_symbol(reader, table)
+            size = symbol & 0x0F
+            level = 0
+            if size:
+                value = reader.read(size)
+                level = value if value >> (size - 1) else value - (1 << size) + 1
+            symbols.append(symbol)
+            levels.append(level)
+            blocks += symbol == EOB
+        return np.array(symbols, dtype=np.uint8), np.array(levels, dtype=np.int32)
@@ -0,0 +1,60 @@
+# color_converter.py
+
+import numpy as np
+import cv2
+
+# Plane layout of every colour format: (subsampling, quantization table of every channel) per plane group
+PLANE_LAYOUTS = {
+    'rgb': ((1, ('luma', 'luma', 'luma')),),
+    'ycbcr420': ((1, ('luma',)), (2, ('chroma', 'chroma'))),
+}
+
+
+class ColorConverter:
+    def __init__(self, color_format='ycbcr420'):
+        """
+        Initializes the ColorConverter.
+
+        Converts RGB frames to the plane groups coded by FrameEncoder and back. A plane group is
+        an (H / s, W / s, C) array of channels that share the subsampling factor s:
+        - 'rgb': one full-resolution group holding R, G and B.
+        - 'ycbcr420': a full-resolution Y group and a CbCr group subsampled 2x in both
+          directions (JPEG full-range YCbCr), i.e. half the samples of RGB.
+
+        :param color_format: 'rgb' or 'ycbcr420'.
+        """
+        if color_format not in PLANE_LAYOUTS:
+            raise ValueError(f"Unknown colour format '{color_format}'. Use one of {tuple(PLANE_LAYOUTS)}.")
+        self.color_format = color_format
+        self.layout = PLANE_LAYOUTS[color_format]
+
+    def to_planes(self, frame):
+        """
+        Converts an RGB frame to its plane groups.
+
+        :param frame: RGB frame (H x W x 3, uint8) with even H and W.
+        :return: List of uint8 plane groups; the first is the full-resolution (luma) group.
+        """
+        if self.color_format == 'rgb':
+            return [frame]
+        height, width = frame.shape[:2]
+        ycrcb = cv2.cvtColor(frame, cv2.COLOR_RGB2YCrCb)
+        luma = np.ascontiguousarray(ycrcb[:, :, :1])
+        # 2x2 averaging of Cb and Cr
+        chroma = cv2.resize(ycrcb[:, :, [2, 1]], (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+        return [luma, chroma]
+
+    def to_frame(self, planes):
+        """
+        Converts plane groups back to an RGB frame (inverse of to_planes).
+
+        :param planes: List of plane groups.
+        :return: RGB frame (H x W x 3, uint8).
+        """
+        if self.color_format == 'rgb':
+            return planes[0]
+        luma, chroma = planes
+        height, width = luma.shape[:2]
+        chroma = cv2.resize(chroma, (width, height), interpolation=cv2.INTER_LINEAR)
+        ycrcb = np.dstack([luma[:, :, 0], chroma[:, :, 1], chroma[:, :, 0]])
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB)
@@ -2,6 +2,7 @@
 
 import numpy as np
 import cv2
+from quantization_tables import QuantizationTables
 
 class CompressionTechniques:
     @staticmethod
@@ -30,13 +31,12 @@ class CompressionTechniques:
 
     @staticmethod
     def quantize(dct_matrix, quality):
-        quantization_factor = (100 - quality) / 50.0
-        quantization_matrix = np.ones_like(dct_matrix) * quantization_factor
+        # Cached luma table resampled to the transform size; samples are scaled to [0, 1]
+        quantization_matrix = QuantizationTables.table(quality, dct_matrix.shape[:2], 'luma', normalized=True)
         quantized = np.round(dct_matrix / quantization_matrix)
         return quantized
 
     @staticmethod
     def dequantize(quantized_matrix, quality):
-        quantization_factor = (100 - quality) / 50.0
-        quantization_matrix = np.ones_like(quantized_matrix) * quantization_factor
+        quantization_matrix = QuantizationTables.table(quality, quantized_matrix.shape[:2], 'luma', normalized=True)
         return quantized_matrix * quantization_matrix
@@ -1,6 +1,14 @@
 
 from collections import defaultdict
 import heapq
+import numpy as np
+from bit_reader import BitReader
+from bit_writer import BitWriter
+
+#Longest code length, as in JPEG: keeps the decoder's fallback search short
+MAX_CODE_LENGTH = 16
+#Codes up to this length are decoded with a single table lookup
+LOOKUP_BITS = 10
 
 class HuffmanCoder:
     #Defining the tree tree structure and the frequency of each char
@@ -15,10 +23,27 @@ class HuffmanCoder:
             return self.freq < other.freq
 
     @staticmethod
+    #This function returns the data as an array of bytes for the fast paths, or None when the
+    #symbols are not all integers in 0..255 (e.g. larger or negative), which the dict paths code
+    def byte_array(data):
+        if isinstance(data, (bytes, bytearray)):
+            return np.frombuffer(data, dtype=np.uint8)
+        if not isinstance(data, np.ndarray) or data.dtype.kind not in 'iu':
+            return None
+        if data.dtype != np.uint8 and data.size and (data.min() < 0 or data.max() > 255):
+            return None
+        return data.ravel()
+
+    @classmethod
     #This function goes through each byte and calculates the frequency of each byte
-    def build_frequency_dict(data):
+    def build_frequency_dict(cls, data):
+        symbols = cls.byte_array(data)
+        if symbols is not None:
+            #Fast path: one histogram over the whole array
+            counts = np.bincount(symbols, minlength=256)
+            return {int(byte): int(counts[byte]) for byte in np.flatnonzero(counts)}
         freq = defaultdict(int)
-        for byte in data:
+        for byte in (data.ravel().tolist() if isinstance(data, np.ndarray) else data):
             freq[byte] += 1
         return freq
 
@@ -56,22 +81,155 @@ class HuffmanCoder:
         return codes
 
     @classmethod
-    #This function compresses the data using the huffman codes
+    #This function returns the code length of each byte, limited to max_length bits
+    def code_lengths(cls, freq, max_length=MAX_CODE_LENGTH):
+        if len(freq) == 1:
+            return {char: 1 for char in freq}
+        depths = {char: len(code) for char, code in cls.generate_huffman_codes(cls.build_huffman_tree(freq)).items()}
+        counts = [0] * (max(depths.values()) + 1)
+        for depth in depths.values():
+            counts[depth] += 1
+        #Codes that are too long are shortened as in JPEG (Annex K.3): two of the longest codes
+        #become one code a bit shorter plus one code split from the longest shorter code available
+        for length in range(len(counts) - 1, max_length, -1):
+            while counts[length] > 0:
+                shorter = length - 2
+                while counts[shorter] == 0:
+                    shorter -= 1
+                counts[length] -= 2
+                counts[length - 1] += 1
+                counts[shorter + 1] += 2
+                counts[shorter] -= 1
+        #The most frequent bytes get the shortest codes
+        ranked = sorted(depths, key=lambda char: (depths[char], -freq[char], char))
+        lengths = {}
+        for length, count in enumerate(counts[:max_length + 1]):
+            for char in ranked[:count]:
+                lengths[char] = length
+            ranked = ranked[count:]
+        return lengths
+
+    @staticmethod
+    #This function assigns canonical codes: ordered by length and then byte, each code is the
+    #previous one plus one, so the code lengths alone define the table
+    def canonical_codes(lengths):
+        codes = {}
+        code, previous = 0, 0
+        for char in sorted(lengths, key=lambda char: (lengths[char], char)):
+            code <<= lengths[char] - previous
+            previous = lengths[char]
+            codes[char] = format(code, f'0{previous}b')
+            code += 1
+        return codes
+
+    @staticmethod
+    #This function serializes a canonical table as in a JPEG DHT segment: the number of codes of
+    #each length (two bytes each), then one byte per symbol in code order
+    def serialize_table(lengths):
+        counts = [0] * MAX_CODE_LENGTH
+        for length in lengths.values():
+            counts[length - 1] += 1
+        ordered = sorted(lengths, key=lambda char: (lengths[char], char))
+        return b''.join(count.to_bytes(2, 'big') for count in counts) + bytes(int(char) for char in ordered)
+
+    @staticmethod
+    #This function reads the code lengths back from serialize_table's bytes
+    def deserialize_table(data):
+        symbols = data[2 * MAX_CODE_LENGTH:]
+        lengths = {}
+        position = 0
+        for length in range(1, MAX_CODE_LENGTH + 1):
+            count = int.from_bytes(data[2 * length - 2:2 * length], 'big')
+            for char in symbols[position:position + count]:
+                lengths[char] = length
+            position += count
+        return lengths
+
+    @staticmethod
+    #This function lays the codes out as arrays of code values and lengths indexed by byte,
+    #so a whole array of bytes is encoded with two gathers (the codes must be of bytes, see byte_array)
+    def code_arrays(codes):
+        if any(not 0 <= int(char) < 256 for char in codes):
+            raise ValueError("Code arrays are indexed by byte: every symbol must be in 0..255.")
+        values = np.zeros(256, dtype=np.int64)
+        lengths = np.zeros(256, dtype=np.int64)
+        for char, code in codes.items():
+            values[int(char)] = int(code, 2)
+            lengths[int(char)] = len(code)
+        return values, lengths
+
+    @staticmethod
+    #This function builds the decoder tables: every LOOKUP_BITS-bit window that starts with a
+    #short code maps to its byte and length; longer codes are searched length by length
+    def decoding_table(codes):
+        lookup_chars = [0] * (1 << LOOKUP_BITS)
+        lookup_lengths = [0] * (1 << LOOKUP_BITS)
+        long_codes = {}
+        for char, code in codes.items():
+            length, value = len(code), int(code, 2)
+            if length <= LOOKUP_BITS:
+                start, end = value << (LOOKUP_BITS - length), (value + 1) << (LOOKUP_BITS - length)
+                lookup_chars[start:end] = [char] * (end - start)
+                lookup_lengths[start:end] = [length] * (end - start)
+            else:
+                long_codes[(length, value)] = char
+        return lookup_chars, lookup_lengths, long_codes, sorted({length for length, _ in long_codes})
+
+    @staticmethod
+    #This function reads one byte with the tables from decoding_table
+    def read_symbol(reader, table):
+        lookup_chars, lookup_lengths, long_codes, long_lengths = table
+        index = reader.peek(LOOKUP_BITS)
+        length = lookup_lengths[index]
+        if length:
+            reader.skip(length)
+            return lookup_chars[index]
+        if long_lengths:
+            window = reader.peek(long_lengths[-1])
+            for length in long_lengths:
+                char = long_codes.get((length, window >> (long_lengths[-1] - length)))
+                if char is not None:
+                    reader.skip(length)
+                    return char
+        raise ValueError(f"Invalid Huffman code at bit {reader.position}.")
+
+    @classmethod
+    #This function compresses the data using canonical huffman codes, packed into bytes
     def compress(cls, data):
         freq = cls.build_frequency_dict(data)
-        root = cls.build_huffman_tree(freq)
-        codes = cls.generate_huffman_codes(root)
-        encoded_data = ''.join(codes[byte] for byte in data)
-        return {'encoded_data': encoded_data, 'codes': codes}
+        codes = cls.canonical_codes(cls.code_lengths(freq))
+        writer = BitWriter()
+        symbols = cls.byte_array(data)
+        if symbols is not None:
+            #Fast path: gather every byte's code and pack them all in one go
+            values, lengths = cls.code_arrays(codes)
+            writer.write_array(values[symbols], lengths[symbols])
+        else:
+            table = {byte: (int(code, 2), len(code)) for byte, code in codes.items()}
+            for byte in (data.ravel().tolist() if isinstance(data, np.ndarray) else data):
+                writer.write(*table[byte])
+        return {'encoded_data': writer.getvalue(), 'length': len(writer), 'codes': codes}
 
     @classmethod
-    def decompress(cls, encoded_data, codes):
-        reverse_codes = {v: k for k, v in codes.items()}
-        current_code = ""
+    #This function decodes with table lookups; length (in bits) stops it before the padding
+    def decompress(cls, encoded_data, codes, length=None):
+        table = cls.decoding_table(codes)
+        reader = BitReader(encoded_data)
+        end = len(reader) if length is None else length
         decoded_data = []
-        for bit in encoded_data:
-            current_code += bit
-            if current_code in reverse_codes:
-                decoded_data.append(int(reverse_codes[current_code]))  # Ensure integers
-                current_code = ""
+        while reader.position < end:
+            decoded_data.append(int(cls.read_symbol(reader, table)))  # Ensure integers
         return decoded_data
+
+#This function checks that symbols outside 0..255 round-trip through the dict paths
+def test_huffman_coder():
+    for data in (np.array([300, 300, 5]), np.array([-3, 7, -3, -3]), np.array([[1, 256], [2, 1]]),
+                 np.array([1, 2, 2, 255], dtype=np.int32), b'\x00\xff\xff', [300, -1, 300]):
+        encoded = HuffmanCoder.compress(data)
+        decoded = HuffmanCoder.decompress(encoded['encoded_data'], encoded['codes'], encoded['length'])
+        expected = list(data) if isinstance(data, (bytes, list)) else np.ravel(data).tolist()
+        assert decoded == expected, f"Huffman round trip of {expected} gave {decoded}"
+    print("Huffman coder round-trip test passed.")
+
+if __name__ == "__main__":
+    test_huffman_coder()
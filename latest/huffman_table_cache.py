@@ -0,0 +1,192 @@
+# huffman_table_cache.py
+
+import numpy as np
+from coefficient_coder import EOB, ZRL, MAX_SIZE
+from huffman_coder import HuffmanCoder, MAX_CODE_LENGTH
+
+# Every symbol run_length_encode can produce: EOB, ZRL and (run << 4) | size
+SYMBOLS = np.array([EOB, ZRL] + [(run << 4) | size for run in range(16) for size in range(1, MAX_SIZE + 1)])
+
+# Ids of the built-in tables, known to every encoder and decoder without being transmitted
+DEFAULT_INTRA_TABLE = 0
+DEFAULT_INTER_TABLE = 1
+
+# Built-in tables in HuffmanCoder.serialize_table form, trained offline by train_huffman_tables.py
+# (see complete_lengths) on the symbols of the 11 frames of Draft/images.zip coded as I-frames and as
+# P/B-frames, with every colour format and transform at qualities 30 to 90. Gains measured on those
+# frames are measured on training data.
+DEFAULT_TABLES = {
+    DEFAULT_INTRA_TABLE: bytes.fromhex(
+        '00000002000100030003000200040003000600040001000000010001000100d201020300041105122131410613225161'
+        '71f00714328191a123b1c1d14208e1f1090a0b0c0d0e0f15161718191a1b1c1d1e1f2425262728292a2b2c2d2e2f3334'
+        '35363738393a3b3c3d3e3f434445464748494a4b4c4d4e4f52535455565758595a5b5c5d5e5f62636465666768696a6b'
+        '6c6d6e6f72737475767778797a7b7c7d7e7f82838485868788898a8b8c8d8e8f92939495969798999a9b9c9d9e9fa2a3'
+        'a4a5a6a7a8a9aaabacadaeafb2b3b4b5b6b7b8b9babbbcbdbebfc2c3c4c5c6c7c8c9cacbcccdcecfd2d3d4d5d6d7d8d9'
+        'dadbdcdddedfe2e3e4e5e6e7e8e9eaebecedeeeff2f3f4f5f6f7f8f9fafbfcfdfeff'),
+    DEFAULT_INTER_TABLE: bytes.fromhex(
+        '00000001000300020004000400040005000300020001000000010001000100d201000211032112314151046171f02281'
+        '91a10513b1c1d132e1f11442062352620708090a0b0c0d0e0f15161718191a1b1c1d1e1f2425262728292a2b2c2d2e2f'
+        '333435363738393a3b3c3d3e3f434445464748494a4b4c4d4e4f535455565758595a5b5c5d5e5f636465666768696a6b'
+        '6c6d6e6f72737475767778797a7b7c7d7e7f82838485868788898a8b8c8d8e8f92939495969798999a9b9c9d9e9fa2a3'
+        'a4a5a6a7a8a9aaabacadaeafb2b3b4b5b6b7b8b9babbbcbdbebfc2c3c4c5c6c7c8c9cacbcccdcecfd2d3d4d5d6d7d8d9'
+        'dadbdcdddedfe2e3e4e5e6e7e8e9eaebecedeeeff2f3f4f5f6f7f8f9fafbfcfdfeff'),
+}
+
+SCOPES = ('frame', 'gop', 'stream')
+
+
+class HuffmanTableCache:
+    def __init__(self, scope='stream', drift=0.02, defaults=True, size=8):
+        """
+        Initializes the HuffmanTableCache.
+
+        Keeps canonical Huffman tables by id so frames can share them: a frame refers to a
+        cached table by its id, and a new table is built (and sent once) only when the frame's
+        symbol statistics have drifted far enough from every cached table (see select).
+        The built-in tables code every symbol the coefficient coder can produce, so any frame
+        can use them; a table built for a frame codes only its symbols, which keeps it small,
+        and is reused by the frames whose symbols it covers.
+
+        :param scope: How long the tables built by the encoder live: 'frame' (a new table for
+                      every frame), 'gop' (dropped at every I-frame) or 'stream'.
+        :param drift: Relative excess of the best cached table's bits over a fresh table's
+                      bits above which a new table is built.
+        :param defaults: Start from the built-in tables (DEFAULT_TABLES).
+        :param size: Number of tables built by the encoder that are kept; the oldest is
+                     evicted first (None keeps all, as a decoder does).
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown Huffman table scope '{scope}'. Use one of {SCOPES}.")
+        self.scope = scope
+        self.drift = drift
+        self.defaults = defaults
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the tables built by the encoder and keeps the built-in ones. Ids then start
+        over, and a reused id always comes with its new table, which replaces the stale one
+        in the decoder's cache.
+        """
+        self.tables = {}
+        self._codes = {}
+        self._decoding_tables = {}
+        self._length_arrays = {}
+        self.next_id = len(DEFAULT_TABLES)
+        if self.defaults:
+            for table_id, data in DEFAULT_TABLES.items():
+                self.add(table_id, HuffmanCoder.deserialize_table(data))
+
+    def start_frame(self, frame_type):
+        """
+        Applies the scope before a frame is coded.
+
+        :param frame_type: 'I', 'P' or 'B'.
+        """
+        if self.scope == 'frame' or (self.scope == 'gop' and frame_type == 'I'):
+            self.reset()
+
+    @staticmethod
+    def complete_lengths(frequencies, floor=1):
+        """
+        Returns code lengths for every symbol in SYMBOLS, built from frequencies in which the
+        symbols that did not occur count `floor` times. This is how the built-in tables were
+        trained, from histograms normalized per frame and scaled to a million symbols.
+
+        :param frequencies: Dict symbol -> count.
+        :param floor: Count of the symbols that did not occur.
+        :return: Dict symbol -> code length.
+        """
+        complete = {int(symbol): max(frequencies.get(int(symbol), 0), floor) for symbol in SYMBOLS}
+        return HuffmanCoder.code_lengths(complete)
+
+    def cost(self, table_id, frequencies):
+        """
+        Returns the bits the symbols of a frame take with a cached table.
+
+        :param table_id: Id of the table.
+        :param frequencies: Dict symbol -> count.
+        :return: Number of bits, infinite if the table lacks one of the symbols.
+        """
+        lengths = self._length_arrays[table_id]
+        symbols = np.fromiter(frequencies, dtype=np.int64, count=len(frequencies))
+        counts = np.fromiter(frequencies.values(), dtype=np.int64, count=len(frequencies))
+        if not lengths[symbols].all():
+            return float('inf')
+        return int(counts @ lengths[symbols])
+
+    def select(self, frequencies):
+        """
+        Chooses the table a frame is coded with: the cached table that codes its symbols in
+        the fewest bits, unless a fresh table would save more than `drift` of its bits and
+        the bits of sending it. Nothing is stored, so a frame may be coded again (e.g. by rate
+        control); add the table once the frame is kept.
+
+        :param frequencies: Dict symbol -> count of the frame's symbols.
+        :return: Tuple (table_id, codes): the id (next_id for a new table, see add) and the
+                 canonical codes of the table.
+        """
+        fresh = HuffmanCoder.code_lengths(frequencies)
+        fresh_bits = sum(frequencies[symbol] * fresh[symbol] for symbol in frequencies)
+        table_bits = 8 * (2 * MAX_CODE_LENGTH + len(fresh))
+        best_id = min(self.tables, key=lambda table_id: self.cost(table_id, frequencies), default=None)
+        if best_id is not None:
+            excess = self.cost(best_id, frequencies) - fresh_bits
+            if excess <= max(table_bits, self.drift * fresh_bits):
+                return best_id, self.codes(best_id)
+        return self.next_id, HuffmanCoder.canonical_codes(fresh)
+
+    def add(self, table_id, lengths):
+        """
+        Stores a table under an id, replacing any table the id had.
+
+        :param table_id: Id of the table.
+        :param lengths: Dict symbol -> code length.
+        """
+        self.tables.pop(table_id, None)
+        self.tables[table_id] = dict(lengths)
+        self._codes.pop(table_id, None)
+        self._decoding_tables.pop(table_id, None)
+        lengths_array = np.zeros(256, dtype=np.int64)
+        lengths_array[list(lengths)] = list(lengths.values())
+        self._length_arrays[table_id] = lengths_array
+        self.next_id = max(self.next_id, table_id + 1)
+        built = [cached for cached in self.tables if cached >= len(DEFAULT_TABLES)]
+        for evicted in built[:max(len(built) - self.size, 0) if self.size is not None else 0]:
+            del self.tables[evicted]
+            self._length_arrays.pop(evicted)
+            self._codes.pop(evicted, None)
+            self._decoding_tables.pop(evicted, None)
+
+    def codes(self, table_id):
+        """
+        Returns the canonical codes of a cached table (built once per table).
+
+        :param table_id: Id of the table.
+        :return: Dict symbol -> code ('0'/'1' string).
+        """
+        if table_id not in self._codes:
+            self._codes[table_id] = HuffmanCoder.canonical_codes(self.tables[table_id])
+        return self._codes[table_id]
+
+    def decoding_table(self, table_id):
+        """
+        Returns the decoder tables of a cached table (see HuffmanCoder.decoding_table), built
+        once per table.
+
+        :param table_id: Id of the table.
+        :return: Decoder tables.
+        """
+        if table_id not in self._decoding_tables:
+            self._decoding_tables[table_id] = HuffmanCoder.decoding_table(self.codes(table_id))
+        return self._decoding_tables[table_id]
+
+    def serialize(self, table_id):
+        """
+        Returns a cached table in HuffmanCoder.serialize_table form.
+
+        :param table_id: Id of the table.
+        :return: bytes.
+        """
+        return HuffmanCoder.serialize_table(self.tables[table_id])
@@ -0,0 +1,169 @@
+# integer_transform.py
+
+import numpy as np
+from quantization_tables import QuantizationTables
+
+# H.264 quantizer multipliers and dequantizer scales by QP % 6, for the three position classes of a
+# 4x4 block: (even, even), (odd, odd) and mixed. They fold the norms of the core transform's basis
+# vectors into quantization, so the transform itself only needs adds and shifts.
+FORWARD_SCALES = np.array([
+    [13107, 5243, 8066],
+    [11916, 4660, 7490],
+    [10082, 4194, 6554],
+    [9362, 3647, 5825],
+    [8192, 3355, 5243],
+    [7282, 2893, 4559],
+], dtype=np.int32)
+
+INVERSE_SCALES = np.array([
+    [10, 16, 13],
+    [11, 18, 14],
+    [13, 20, 16],
+    [14, 23, 18],
+    [16, 25, 20],
+    [18, 29, 23],
+], dtype=np.int32)
+
+# Position class of every coefficient of a 4x4 block
+POSITION_CLASSES = np.array([
+    [0, 2, 0, 2],
+    [2, 1, 2, 1],
+    [0, 2, 0, 2],
+    [2, 1, 2, 1],
+])
+
+MAX_QP = 51
+
+
+class IntegerTransform:
+    # Quantization scales built so far, keyed by (quality, planes)
+    _cache = {}
+
+    @staticmethod
+    def qstep(qp):
+        """
+        Returns the H.264 quantizer step size of a QP (doubles every 6 steps).
+
+        :param qp: Quantization parameter in 0..51.
+        :return: Step size in sample units of the orthonormal transform.
+        """
+        return 0.625 * 2 ** (qp / 6)
+
+    @staticmethod
+    def _butterfly(blocks, axis, inverse=False):
+        """
+        Applies the 4-point core transform (or its inverse) along one axis with adds and shifts.
+
+        :param blocks: int32 array with a block axis of length 4.
+        :param axis: Axis to transform.
+        :param inverse: Apply the inverse transform.
+        :return: int32 array with the same shape.
+        """
+        x0, x1, x2, x3 = np.moveaxis(blocks, axis, 0)
+        if inverse:
+            even0, even1 = x0 + x2, x0 - x2
+            odd0, odd1 = (x1 >> 1) - x3, x1 + (x3 >> 1)
+            rows = (even0 + odd1, even1 + odd0, even1 - odd0, even0 - odd1)
+        else:
+            sum03, diff03, sum12, diff12 = x0 + x3, x0 - x3, x1 + x2, x1 - x2
+            rows = (sum03 + sum12, (diff03 << 1) + diff12, sum03 - sum12, diff03 - (diff12 << 1))
+        return np.moveaxis(np.stack(rows), 0, axis)
+
+    @classmethod
+    def forward(cls, blocks):
+        """
+        Applies the H.264 4x4 core transform to every block and channel of a block tensor.
+
+        :param blocks: Integer array (rows, cols, 4, 4, C) of samples or residuals.
+        :return: int32 coefficients with the same layout (unscaled, see quantize).
+        """
+        blocks = blocks.astype(np.int32)
+        return cls._butterfly(cls._butterfly(blocks, 3), 2)
+
+    @classmethod
+    def inverse(cls, coefficients):
+        """
+        Applies the H.264 4x4 inverse core transform, including the final rounding shift.
+
+        :param coefficients: int32 array (rows, cols, 4, 4, C) of dequantized coefficients.
+        :return: int32 samples with the same layout.
+        """
+        samples = cls._butterfly(cls._butterfly(coefficients.astype(np.int32), 2, inverse=True), 3, inverse=True)
+        return (samples + 32) >> 6
+
+    @classmethod
+    def scales(cls, quality, planes):
+        """
+        Returns the integer quantization parameters for a quality and the channels of a plane group.
+
+        Each channel gets the QP whose step size matches the smallest step of its quality-scaled
+        4x4 table (see QuantizationTables), plus a weighting matrix in sixteenths (16 is flat)
+        that restores the table's per-frequency steps, like an H.264 scaling list. The weights
+        are merged into the integer multipliers (see multipliers). Results are cached and read-only.
+
+        :param quality: Quality in 1..100.
+        :param planes: Plane of every channel, e.g. ('chroma', 'chroma').
+        :return: Tuple (qp, weights): int32 arrays (C,) and (4, 4, C).
+        """
+        key = (quality, tuple(planes))
+        if key not in cls._cache:
+            qps, weights = [], []
+            for plane in planes:
+                table = QuantizationTables.table(quality, 4, plane).astype(np.float64)
+                qp = int(np.clip(np.round(6 * np.log2(table.min() / 0.625)), 0, MAX_QP))
+                weights.append(np.clip(np.round(16 * table / cls.qstep(qp)), 1, 255).astype(np.int32))
+                qps.append(qp)
+            scales = (np.array(qps, dtype=np.int32), np.stack(weights, axis=-1))
+            for array in scales:
+                array.setflags(write=False)
+            cls._cache[key] = scales
+        return cls._cache[key]
+
+    @staticmethod
+    def multipliers(qp, weights):
+        """
+        Merges the H.264 scales of a QP with a weighting matrix.
+
+        :param qp: int array of QPs broadcastable to (..., 4, 4, C), e.g. (C,) or (rows, cols, 1, 1, C).
+        :param weights: int array (4, 4, C) of weights in sixteenths.
+        :return: Tuple (forward, inverse) of int32 quantizer multipliers and dequantizer scales.
+        """
+        remainder = np.asarray(qp) % 6
+        classes = POSITION_CLASSES[:, :, np.newaxis]
+        forward = np.round(FORWARD_SCALES[remainder, classes] * 16 / weights).astype(np.int32)
+        return forward, INVERSE_SCALES[remainder, classes] * weights
+
+    @classmethod
+    def quantize(cls, coefficients, qp, weights, intra=True):
+        """
+        Quantizes core transform coefficients: (|W| * scale + offset) >> (15 + QP / 6), with the
+        sign restored. The rounding offset is 1/3 of a step for intra blocks and 1/6 for residuals.
+
+        :param coefficients: int32 array (..., 4, 4, C) from forward().
+        :param qp: int array of QPs broadcastable to the coefficients (per channel or per block).
+        :param weights: int array (4, 4, C) of weights in sixteenths.
+        :param intra: Use the intra rounding offset.
+        :return: int32 levels with the same shape.
+        """
+        forward, _ = cls.multipliers(qp, weights)
+        shift = 15 + qp // 6
+        offset = (1 << shift) // (3 if intra else 6)
+        levels = (np.abs(coefficients) * forward + offset) >> shift
+        return np.sign(coefficients) * levels
+
+    @classmethod
+    def dequantize(cls, levels, qp, weights):
+        """
+        Rescales levels for the inverse core transform, as the H.264 decoder does for weighted
+        (scaling list) quantization.
+
+        :param levels: int array (..., 4, 4, C).
+        :param qp: int array of QPs broadcastable to the levels (per channel or per block).
+        :param weights: int array (4, 4, C) of weights in sixteenths.
+        :return: int32 coefficients with the same shape.
+        """
+        _, inverse = cls.multipliers(qp, weights)
+        scaled = levels.astype(np.int32) * inverse
+        shift = qp // 6 - 4
+        rounding = np.where(shift < 0, 1 << np.maximum(-shift - 1, 0), 0)
+        return np.where(shift >= 0, scaled << np.maximum(shift, 0), (scaled + rounding) >> np.maximum(-shift, 0))
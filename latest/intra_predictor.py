@@ -0,0 +1,77 @@
+# intra_predictor.py
+
+import numpy as np
+
+# Intra prediction modes of a macroblock, numbered as H.264's 16x16 luma modes
+INTRA_VERTICAL = 0
+INTRA_HORIZONTAL = 1
+INTRA_DC = 2
+INTRA_PLANAR = 3
+INTRA_MODES = 4
+INTRA_MODE_BITS = 2
+
+
+class IntraPredictor:
+    @staticmethod
+    def edges(plane, rows, cols, size):
+        """
+        Gathers the reconstructed samples above and to the left of macroblocks.
+
+        :param plane: Plane group (H x W x C) holding the samples reconstructed so far.
+        :param rows: int array (M,) of macroblock rows.
+        :param cols: int array (M,) of macroblock columns.
+        :param size: Macroblock size in the plane group.
+        :return: Tuple (top, left, corner, has_top, has_left): int32 arrays (M, size, C), (M, size, C)
+                 and (M, C) of edge samples, and boolean arrays (M,) telling which edges exist
+                 (macroblocks on the first row or column have none above or to the left).
+        """
+        y, x = rows * size, cols * size
+        above, before = np.maximum(y - 1, 0), np.maximum(x - 1, 0)
+        offsets = np.arange(size)
+        top = plane[above[:, np.newaxis], x[:, np.newaxis] + offsets].astype(np.int32)
+        left = plane[y[:, np.newaxis] + offsets, before[:, np.newaxis]].astype(np.int32)
+        corner = plane[above, before].astype(np.int32)
+        return top, left, corner, rows > 0, cols > 0
+
+    @staticmethod
+    def predict(top, left, corner, has_top, has_left):
+        """
+        Builds the four intra predictions of macroblocks from their edges, as H.264 does for
+        16x16 luma and for chroma blocks. Everything is computed in integers, so the encoder
+        and the decoder agree bit for bit. A mode whose edges do not exist falls back to DC,
+        and DC without any edge predicts 128.
+
+        :param top: int32 array (M, size, C) of the samples above every macroblock.
+        :param left: int32 array (M, size, C) of the samples to the left.
+        :param corner: int32 array (M, C) of the samples above and to the left.
+        :param has_top: Boolean array (M,), the samples above exist.
+        :param has_left: Boolean array (M,), the samples to the left exist.
+        :return: int32 array (INTRA_MODES, M, size, size, C) of predictions, indexed by mode.
+        """
+        count, size, channels = top.shape
+        # DC: rounded mean of the existing edges
+        edge_samples = size * (has_top.astype(np.int32) + has_left)[:, np.newaxis]
+        total = top.sum(axis=1) * has_top[:, np.newaxis] + left.sum(axis=1) * has_left[:, np.newaxis]
+        dc = np.where(edge_samples > 0, (total + edge_samples // 2) // np.maximum(edge_samples, 1), 128)
+        dc = np.broadcast_to(dc[:, np.newaxis, np.newaxis, :], (count, size, size, channels))
+
+        vertical = np.where(has_top[:, np.newaxis, np.newaxis, np.newaxis], top[:, np.newaxis, :, :], dc)
+        horizontal = np.where(has_left[:, np.newaxis, np.newaxis, np.newaxis], left[:, :, np.newaxis, :], dc)
+
+        # Planar: a plane through the far edge samples whose gradients are weighted differences
+        # of the edges around their centres (the corner sample closes both sums)
+        half = size // 2
+        weights = np.arange(1, half + 1)
+        top_edge = np.concatenate([corner[:, np.newaxis], top], axis=1)
+        left_edge = np.concatenate([corner[:, np.newaxis], left], axis=1)
+        gradient_x = ((top_edge[:, half + weights] - top_edge[:, half - weights]) * weights[:, np.newaxis]).sum(axis=1)
+        gradient_y = ((left_edge[:, half + weights] - left_edge[:, half - weights]) * weights[:, np.newaxis]).sum(axis=1)
+        # pred = (top[-1] + left[-1]) / 2 + (gradient_x * (x - centre) + gradient_y * (y - centre)) / norm
+        norm = 2 * int((weights ** 2).sum())
+        position = 2 * np.arange(size) - size + 1
+        numerator = (norm * (top[:, -1] + left[:, -1])[:, np.newaxis, np.newaxis, :]
+                     + gradient_x[:, np.newaxis, np.newaxis, :] * position[np.newaxis, np.newaxis, :, np.newaxis]
+                     + gradient_y[:, np.newaxis, np.newaxis, :] * position[np.newaxis, :, np.newaxis, np.newaxis])
+        planar = np.clip((numerator + norm) // (2 * norm), 0, 255)
+        planar = np.where((has_top & has_left)[:, np.newaxis, np.newaxis, np.newaxis], planar, dc)
+        return np.stack([vertical, horizontal, dc, planar]).astype(np.int32)
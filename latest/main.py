@@ -15,6 +15,28 @@ def parse_arguments():
     parser.add_argument('--width', type=int, default=480, help='Width of the video frames')
     parser.add_argument('--height', type=int, default=640, help='Height of the video frames')
     parser.add_argument('--framerate', type=int, default=24, help='Frame rate for playback')
+    parser.add_argument('--motion_strategy', type=str, choices=['full', 'three_step', 'diamond', 'hexagon', 'pyramid', 'optical_flow'], default='full', help='Motion search strategy')
+    parser.add_argument('--search_range', type=int, default=8, help='Motion search range in pixels')
+    parser.add_argument('--motion_predictors', action='store_true', help='Seed fast motion searches from neighbouring and previous-frame vectors')
+    parser.add_argument('--subpel', type=str, choices=['half', 'quarter'], default=None, help='Sub-pixel motion refinement')
+    parser.add_argument('--motion_plane', type=str, choices=['color', 'luma'], default='color', help='Plane used for motion search')
+    parser.add_argument('--motion_decimate', action='store_true', help='Run a 2x decimated coarse motion search first')
+    parser.add_argument('--global_motion', type=str, choices=['translation', 'affine'], default=None, help='Global motion pre-pass seeding the block search')
+    parser.add_argument('--color_format', type=str, choices=['ycbcr420', 'rgb'], default='ycbcr420', help='Colour format of the coded planes')
+    parser.add_argument('--transform_size', type=int, choices=[4, 8, 16], default=8, help='DCT block size inside each macroblock')
+    parser.add_argument('--quality', type=int, default=90, help='Quantization quality (1..100); the starting quality under rate control')
+    parser.add_argument('--target_bitrate', type=float, default=None, help='Rate control: target bitrate in kbit/s')
+    parser.add_argument('--byte_budget', type=int, default=None, help='Rate control: size budget of the compressed data in bytes')
+    parser.add_argument('--adaptive_quantization', action='store_true', help='Per-macroblock quantizer offsets from block activity')
+    parser.add_argument('--aq_strength', type=float, default=1.0, help='QP offset per doubling of macroblock variance')
+    parser.add_argument('--skip_threshold', type=float, default=1.0, help='Mean absolute residual up to which inter-coded P/B macroblocks are skipped')
+    parser.add_argument('--huffman_tables', type=str, choices=['frame', 'gop', 'stream'], default='stream', help='How long a Huffman table is reused by later frames')
+    parser.add_argument('--table_drift', type=float, default=0.02, help='Relative excess bits of the cached Huffman tables above which a frame gets a new table')
+    parser.add_argument('--no_default_tables', action='store_true', help='Do not start from the built-in Huffman tables')
+    parser.add_argument('--transform', type=str, choices=['dct', 'integer'], default='dct', help='Transform: floating-point DCT or H.264 4x4 integer transform (needs --transform_size 4)')
+    parser.add_argument('--motion_backend', type=str, choices=['numpy', 'opencv'], default='numpy', help='Motion estimation backend')
+    parser.add_argument('--motion_workers', type=int, default=1, help='Number of motion search workers')
+    parser.add_argument('--motion_parallel_backend', type=str, choices=['thread', 'process'], default='thread', help='Worker pool used by the motion search')
     args = parser.parse_args()
     return args
 
@@ -31,10 +53,31 @@ def main():
             output_path=args.output,
             metadata_output_path=args.metadata,
             resolution=(args.width, args.height),
-            compression_quality=90,
+            compression_quality=args.quality,
             codec='h264',
             gop_size=10,
-            b_frame_interval=2
+            b_frame_interval=2,
+            motion_strategy=args.motion_strategy,
+            search_range=args.search_range,
+            motion_predictors=args.motion_predictors,
+            subpel=args.subpel,
+            motion_plane=args.motion_plane,
+            motion_decimate=args.motion_decimate,
+            motion_workers=args.motion_workers,
+            motion_parallel_backend=args.motion_parallel_backend,
+            motion_backend=args.motion_backend,
+            global_motion=args.global_motion,
+            transform_size=args.transform_size,
+            color_format=args.color_format,
+            transform=args.transform,
+            target_bitrate=args.target_bitrate * 1000 if args.target_bitrate is not None else None,
+            byte_budget=args.byte_budget,
+            adaptive_quantization=args.adaptive_quantization,
+            aq_strength=args.aq_strength,
+            skip_threshold=args.skip_threshold,
+            huffman_tables=args.huffman_tables,
+            table_drift=args.table_drift,
+            default_tables=not args.no_default_tables
         )
         encoder.encode_video()
 
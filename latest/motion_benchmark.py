@@ -0,0 +1,305 @@
+# motion_benchmark.py
+
+import argparse
+import json
+import platform
+import time
+import numpy as np
+import cv2
+from motion_estimator import MotionEstimator
+from opencv_motion_estimator import OpenCVMotionEstimator
+
+# Motion estimation backends by name, as selected in VideoEncoder
+BACKENDS = {'numpy': MotionEstimator, 'opencv': OpenCVMotionEstimator}
+
+# Configurations run by default: backend, strategy and extra estimator arguments
+DEFAULT_CONFIGURATIONS = [
+    {'backend': 'numpy', 'strategy': 'full'},
+    {'backend': 'numpy', 'strategy': 'three_step'},
+    {'backend': 'numpy', 'strategy': 'diamond'},
+    {'backend': 'numpy', 'strategy': 'hexagon'},
+    {'backend': 'numpy', 'strategy': 'pyramid'},
+    {'backend': 'numpy', 'strategy': 'diamond', 'predictors': True},
+    {'backend': 'numpy', 'strategy': 'hexagon', 'global_motion': 'translation'},
+    {'backend': 'opencv', 'strategy': 'full'},
+    {'backend': 'opencv', 'strategy': 'optical_flow'},
+]
+
+
+class MotionBenchmark:
+    def __init__(self, width=320, height=240, num_frames=6, block_size=16, search_range=8, seed=0):
+        """
+        Initializes the MotionBenchmark.
+
+        Generates deterministic synthetic sequences with known motion and measures the speed and
+        accuracy of motion estimation configurations on them.
+
+        :param width: Frame width in pixels.
+        :param height: Frame height in pixels.
+        :param num_frames: Number of frames per sequence.
+        :param block_size: Macroblock size.
+        :param search_range: Motion search range in pixels.
+        :param seed: Seed of the random textures and object placement.
+        """
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+        self.block_size = block_size
+        self.search_range = search_range
+        self.seed = seed
+        self.results = []
+
+    def _texture(self, rng, height, width):
+        """
+        Creates a smooth random RGB texture, so every block has a unique best match.
+
+        :param rng: NumPy random generator.
+        :param height: Texture height.
+        :param width: Texture width.
+        :return: uint8 array (height, width, 3).
+        """
+        noise = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        return cv2.GaussianBlur(noise, (5, 5), 0)
+
+    def generate_sequences(self):
+        """
+        Generates the benchmark sequences.
+
+        Every sequence is a dict with 'name', 'frames' (list of RGB frames) and 'truth': per frame
+        (from the second on) a (rows, cols, 2) array of true (dx, dy) block vectors and a
+        (rows, cols) mask of blocks whose motion is unambiguous (a single object that is not
+        occluded and stays inside the frame).
+
+        :return: List of sequence dicts.
+        """
+        rng = np.random.default_rng(self.seed)
+        return [self._shifted_texture(rng, 'pan_small', (3, -2)),
+                self._shifted_texture(rng, 'pan_large', (-7, 5)),
+                self._moving_rectangles(rng, 'moving_rectangles', count=6)]
+
+    def _shifted_texture(self, rng, name, velocity):
+        """
+        Generates a camera pan: a texture moving by a constant (vx, vy) per frame.
+
+        :param rng: NumPy random generator.
+        :param name: Sequence name.
+        :param velocity: Content motion (vx, vy) in pixels per frame.
+        :return: Sequence dict.
+        """
+        vx, vy = velocity
+        margin_x, margin_y = abs(vx) * self.num_frames, abs(vy) * self.num_frames
+        texture = self._texture(rng, self.height + 2 * margin_y, self.width + 2 * margin_x)
+        frames, labels = [], []
+        for t in range(self.num_frames):
+            top, left = margin_y - t * vy, margin_x - t * vx
+            frames.append(texture[top:top + self.height, left:left + self.width].copy())
+            labels.append(np.zeros((self.height, self.width), dtype=np.int32))
+        return self._sequence(name, frames, labels, {0: (vx, vy)})
+
+    def _moving_rectangles(self, rng, name, count):
+        """
+        Generates textured rectangles moving over a static textured background, in the style of
+        create_images.py.
+
+        :param rng: NumPy random generator.
+        :param name: Sequence name.
+        :param count: Number of rectangles; later rectangles are drawn on top.
+        :return: Sequence dict.
+        """
+        background = self._texture(rng, self.height, self.width)
+        rectangles = []
+        for label in range(1, count + 1):
+            rect_height = int(rng.integers(self.height // 6, self.height // 2))
+            rect_width = int(rng.integers(self.width // 6, self.width // 2))
+            rectangles.append({
+                'label': label,
+                'y': int(rng.integers(0, self.height - rect_height)),
+                'x': int(rng.integers(0, self.width - rect_width)),
+                'velocity': tuple(int(v) for v in rng.integers(-self.search_range // 2, self.search_range // 2 + 1, 2)),
+                'texture': self._texture(rng, rect_height, rect_width) // 2 + rng.integers(0, 128, 3).astype(np.uint8),
+            })
+
+        frames, labels = [], []
+        for t in range(self.num_frames):
+            frame = background.copy()
+            label_map = np.zeros((self.height, self.width), dtype=np.int32)
+            for rect in rectangles:
+                vx, vy = rect['velocity']
+                rect_height, rect_width = rect['texture'].shape[:2]
+                top, left = rect['y'] + t * vy, rect['x'] + t * vx
+                y0, y1 = max(top, 0), min(top + rect_height, self.height)
+                x0, x1 = max(left, 0), min(left + rect_width, self.width)
+                if y1 > y0 and x1 > x0:
+                    frame[y0:y1, x0:x1] = rect['texture'][y0 - top:y1 - top, x0 - left:x1 - left]
+                    label_map[y0:y1, x0:x1] = rect['label']
+            frames.append(frame)
+            labels.append(label_map)
+        velocities = {0: (0, 0), **{rect['label']: rect['velocity'] for rect in rectangles}}
+        return self._sequence(name, frames, labels, velocities)
+
+    def _sequence(self, name, frames, labels, velocities):
+        """
+        Derives the per-block ground truth of a sequence from its object label maps.
+
+        A target block is valid when all its pixels belong to one object and the block it is
+        predicted from, displaced by the object's motion, lies inside the reference frame and
+        belongs entirely to the same object there.
+
+        :param name: Sequence name.
+        :param frames: List of RGB frames.
+        :param labels: List of (H, W) object label maps.
+        :param velocities: Dict of object label -> content motion (vx, vy) per frame.
+        :return: Sequence dict.
+        """
+        bs = self.block_size
+        rows, cols = self.height // bs, self.width // bs
+        truth = [None]
+        for t in range(1, len(frames)):
+            vectors = np.zeros((rows, cols, 2), dtype=np.int64)
+            valid = np.zeros((rows, cols), dtype=bool)
+            for row in range(rows):
+                for col in range(cols):
+                    y, x = row * bs, col * bs
+                    block_labels = labels[t][y:y + bs, x:x + bs]
+                    label = int(block_labels[0, 0])
+                    vx, vy = velocities[label]
+                    # The content moved by (vx, vy), so it is found at (x - vx, y - vy) in the reference
+                    dx, dy = -vx, -vy
+                    vectors[row, col] = (dx, dy)
+                    if (block_labels != label).any():
+                        continue
+                    if not (0 <= y + dy <= self.height - bs and 0 <= x + dx <= self.width - bs):
+                        continue
+                    valid[row, col] = (labels[t - 1][y + dy:y + dy + bs, x + dx:x + dx + bs] == label).all()
+            truth.append({'vectors': vectors, 'valid': valid})
+        return {'name': name, 'frames': frames, 'truth': truth}
+
+    def _estimator(self, configuration):
+        """
+        Creates the motion estimator of a configuration.
+
+        :param configuration: Dict with 'backend', 'strategy' and extra estimator arguments.
+        :return: Motion estimator.
+        """
+        options = {key: value for key, value in configuration.items() if key != 'backend'}
+        backend = BACKENDS[configuration.get('backend', 'numpy')]
+        return backend(search_range=self.search_range, block_size=self.block_size, **options)
+
+    def run_configuration(self, configuration, sequence):
+        """
+        Runs one configuration over one sequence, predicting every frame from the previous one.
+
+        :param configuration: Estimator configuration dict.
+        :param sequence: Sequence dict from generate_sequences().
+        :return: Result dict.
+        """
+        estimator = self._estimator(configuration)
+        estimator.reset_motion_cache()
+        bs = self.block_size
+        frames = sequence['frames']
+        seconds = 0.0
+        blocks = candidates = correct = valid_blocks = 0
+        vector_errors, psnrs = [], []
+        for t in range(1, len(frames)):
+            start = time.perf_counter()
+            motion_vectors = estimator.estimate_motion(frames[t - 1], frames[t])
+            seconds += time.perf_counter() - start
+            blocks += len(motion_vectors)
+            candidates += estimator.stats['candidates_evaluated']
+
+            rows, cols = self.height // bs, self.width // bs
+            estimated = np.asarray(motion_vectors, dtype=np.float64).reshape(rows, cols, 2)
+            truth = sequence['truth'][t]
+            valid = truth['valid']
+            errors = np.linalg.norm(estimated[valid] - truth['vectors'][valid], axis=-1)
+            correct += int(np.count_nonzero(errors == 0))
+            valid_blocks += int(np.count_nonzero(valid))
+            vector_errors.extend(errors.tolist())
+            psnrs.append(self._prediction_psnr(estimator, frames[t - 1], frames[t], motion_vectors))
+        estimator.close()
+
+        return {
+            'sequence': sequence['name'],
+            'configuration': configuration,
+            'frames': len(frames) - 1,
+            'blocks': blocks,
+            'seconds': seconds,
+            'blocks_per_second': blocks / seconds if seconds > 0 else None,
+            'candidates_evaluated': candidates,
+            'candidates_per_block': candidates / max(blocks, 1),
+            'vector_accuracy': correct / max(valid_blocks, 1),
+            'mean_vector_error': float(np.mean(vector_errors)) if vector_errors else 0.0,
+            'psnr': float(np.mean(psnrs)),
+        }
+
+    def _prediction_psnr(self, estimator, reference_frame, target_frame, motion_vectors):
+        """
+        Computes the PSNR of the motion-compensated prediction of a frame.
+
+        :param estimator: Motion estimator that produced the vectors (its interpolator is used).
+        :param reference_frame: Reference frame.
+        :param target_frame: Target frame.
+        :param motion_vectors: List of (dx, dy) vectors in raster order.
+        :return: PSNR in dB over the whole macroblocks.
+        """
+        bs = self.block_size
+        rows, cols = self.height // bs, self.width // bs
+        block_y, block_x = np.meshgrid(np.arange(rows) * bs, np.arange(cols) * bs, indexing='ij')
+        units = np.array([estimator.interpolator.to_units(mv) for mv in motion_vectors], dtype=np.int64)
+        predicted = estimator.interpolator.predict_blocks(reference_frame, block_y.ravel(), block_x.ravel(), units, bs)
+        target = target_frame[:rows * bs, :cols * bs].reshape(rows, bs, cols, bs, -1).transpose(0, 2, 4, 1, 3)
+        mse = np.mean((predicted.astype(np.float64) - target.reshape(predicted.shape)) ** 2)
+        return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+    def run(self, configurations=None):
+        """
+        Runs every configuration on every sequence.
+
+        :param configurations: List of configuration dicts (defaults to DEFAULT_CONFIGURATIONS).
+        :return: List of result dicts.
+        """
+        sequences = self.generate_sequences()
+        self.results = []
+        for configuration in configurations or DEFAULT_CONFIGURATIONS:
+            for sequence in sequences:
+                result = self.run_configuration(configuration, sequence)
+                self.results.append(result)
+                print(f"{sequence['name']:>18} {configuration}: {result['blocks_per_second']:.0f} blocks/s, "
+                      f"{result['candidates_per_block']:.1f} candidates/block, "
+                      f"accuracy {result['vector_accuracy']:.3f}, PSNR {result['psnr']:.2f} dB")
+        return self.results
+
+    def save(self, path):
+        """
+        Saves the results with the benchmark settings as JSON.
+
+        :param path: Output file path.
+        """
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'settings': {'width': self.width, 'height': self.height, 'num_frames': self.num_frames,
+                         'block_size': self.block_size, 'search_range': self.search_range, 'seed': self.seed},
+            'results': self.results,
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Benchmark results saved to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Motion estimation benchmark")
+    parser.add_argument('--output', type=str, default='motion_benchmark.json', help='Path of the JSON report')
+    parser.add_argument('--width', type=int, default=320, help='Width of the synthetic frames')
+    parser.add_argument('--height', type=int, default=240, help='Height of the synthetic frames')
+    parser.add_argument('--frames', type=int, default=6, help='Number of frames per sequence')
+    parser.add_argument('--search_range', type=int, default=8, help='Motion search range in pixels')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic sequences')
+    args = parser.parse_args()
+
+    benchmark = MotionBenchmark(width=args.width, height=args.height, num_frames=args.frames,
+                                search_range=args.search_range, seed=args.seed)
+    benchmark.run()
+    benchmark.save(args.output)
@@ -2,55 +2,860 @@
 
 import numpy as np
 import cv2
+from band_executor import BandExecutor
+from reference_cache import ReferenceCache
+from subpel_interpolator import SubpelInterpolator
+
+# Search patterns as (dy, dx) offsets around the current centre (centre excluded)
+LARGE_DIAMOND = np.array([(-2, 0), (-1, -1), (-1, 1), (0, -2), (0, 2), (1, -1), (1, 1), (2, 0)])
+SMALL_DIAMOND = np.array([(-1, 0), (0, -1), (0, 1), (1, 0)])
+LARGE_HEXAGON = np.array([(-2, -1), (-2, 1), (0, -2), (0, 2), (2, -1), (2, 1)])
+SQUARE = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+
+# Vector precision (fractions of a pixel) of the sub-pixel refinement modes
+SUBPEL_PRECISION = {None: 1, 'half': 2, 'quarter': 4}
+
+
+# Matching kernels. They are module-level functions of plain arrays so that BandExecutor can run
+# them on bands of blocks in worker threads or processes.
+
+def _matching_error(difference, cost):
+    """
+    Converts signed differences to per-sample matching errors.
+
+    :param difference: int32 difference array.
+    :param cost: 'ssd' or 'sad'.
+    :return: Squared or absolute differences.
+    """
+    if cost == 'ssd':
+        return difference * difference
+    return np.abs(difference)
+
+
+def _gather_costs(reference, blocks, index, cand_y, cand_x, cost, max_batch_elements):
+    """
+    Computes the costs of candidate positions for blocks[index].
+
+    Candidate blocks are gathered from a strided sliding-window view of the reference.
+
+    :param reference: int32 reference frame (H, W, C).
+    :param blocks: int32 target blocks of the whole frame (N, C, bs, bs).
+    :param index: Blocks of the band (n,).
+    :param cand_y: (n, K) clipped top rows of the candidates.
+    :param cand_x: (n, K) clipped left columns of the candidates.
+    :param cost: 'ssd' or 'sad'.
+    :param max_batch_elements: Upper bound on pixels gathered at once.
+    :return: int64 array (n, K).
+    """
+    channels, bs = blocks.shape[1], blocks.shape[-1]
+    windows = np.lib.stride_tricks.sliding_window_view(reference, (bs, bs), axis=(0, 1))
+    n, k = cand_y.shape
+    costs = np.empty((n, k), dtype=np.int64)
+    chunk = max(1, max_batch_elements // max(k * channels * bs * bs, 1))
+    for first in range(0, n, chunk):
+        last = min(first + chunk, n)
+        difference = windows[cand_y[first:last], cand_x[first:last]] - blocks[index[first:last], np.newaxis]
+        costs[first:last] = _matching_error(difference, cost).sum(axis=(2, 3, 4), dtype=np.int64)
+    return costs
+
+
+def _gather_subpel_costs(planes, blocks, block_index, phase_y, phase_x, y, x, cost, max_batch_elements):
+    """
+    Computes the costs of fractional candidates gathered from interpolated phase planes.
+
+    :param planes: uint8 phase planes (P, P, H', W', C).
+    :param blocks: int32 target blocks (n, C, bs, bs).
+    :param block_index: Target block of every candidate (m,).
+    :param phase_y: Vertical phase of every candidate (m,).
+    :param phase_x: Horizontal phase of every candidate (m,).
+    :param y: Top row of every candidate in the padded planes (m,).
+    :param x: Left column of every candidate in the padded planes (m,).
+    :param cost: 'ssd' or 'sad'.
+    :param max_batch_elements: Upper bound on pixels gathered at once.
+    :return: int64 array (m,).
+    """
+    bs = blocks.shape[-1]
+    costs = np.empty(len(block_index), dtype=np.int64)
+    chunk = max(1, max_batch_elements // max(blocks[0].size, 1))
+    for first in range(0, len(block_index), chunk):
+        last = min(first + chunk, len(block_index))
+        predicted = SubpelInterpolator.gather(planes, phase_y[first:last], phase_x[first:last], y[first:last], x[first:last], bs)
+        difference = predicted.astype(np.int32) - blocks[block_index[first:last]]
+        costs[first:last] = _matching_error(difference, cost).sum(axis=(1, 2, 3), dtype=np.int64)
+    return costs
+
+
+def _band_cost_volume(padded, target, row_start, row_stop, offsets, search_range, block_size, cost):
+    """
+    Computes the full-search cost volume of the macroblock rows [row_start, row_stop).
+
+    :param padded: int32 reference frame edge-padded by search_range (H + 2R, W + 2R, C).
+    :param target: int32 target frame (H, W, C).
+    :param row_start: First macroblock row of the band.
+    :param row_stop: End of the band.
+    :param offsets: (K, 2) candidate (dy, dx) displacements.
+    :param search_range: Padding of the reference.
+    :param block_size: Block size.
+    :param cost: 'ssd' or 'sad'.
+    :return: int64 array (K, row_stop - row_start, cols) without validity masking.
+    """
+    bs = block_size
+    top, bottom = row_start * bs, row_stop * bs
+    band = target[top:bottom]
+    height, width, channels = band.shape
+    volume = np.empty((len(offsets), height // bs, width // bs), dtype=np.int64)
+    for k, (dy, dx) in enumerate(offsets):
+        shifted = padded[top + search_range + dy:bottom + search_range + dy, search_range + dx:search_range + dx + width]
+        # Strided block view: (rows, bs, cols, bs, C) -> sum over the pixels of each block
+        error = _matching_error(band - shifted, cost).reshape(height // bs, bs, width // bs, bs, channels)
+        volume[k] = error.sum(axis=(1, 3, 4), dtype=np.int64)
+    return volume
+
 
 class MotionEstimator:
-    def __init__(self, search_range=8, block_size=16):
+    # Cost assigned to candidates that fall outside the reference frame or search window
+    _invalid_cost = np.iinfo(np.int64).max
+
+    STRATEGIES = ('full', 'three_step', 'diamond', 'hexagon', 'pyramid')
+
+    def __init__(self, search_range=8, block_size=16, cost='ssd', strategy='full', max_batch_elements=1 << 23,
+                 pyramid_levels=3, refine_range=2, reference_cache_size=2, predictors=False,
+                 zero_motion_threshold=0.5, early_termination_threshold=2.0, subpel=None, search_plane='color',
+                 decimate=False, workers=1, parallel_backend='thread', global_motion=None, global_motion_threshold=1.0,
+                 global_motion_stride=4):
         """
         Initializes the MotionEstimator.
-        
+
         :param search_range: Range of pixels to search for motion (default is 8).
         :param block_size: Size of the macroblocks (default is 16x16).
+        :param cost: Block matching cost, 'ssd' (sum of squared differences) or 'sad' (sum of absolute differences).
+        :param strategy: Search strategy: 'full' (exhaustive), 'three_step', 'diamond', 'hexagon' or
+                         'pyramid' (hierarchical search, see estimate_motion_hierarchical).
+        :param max_batch_elements: Upper bound on the number of pixels gathered at once when
+                                   evaluating candidate blocks, to cap temporary memory.
+        :param pyramid_levels: Number of resolution levels used by the hierarchical search.
+        :param refine_range: Refinement window (+/- pixels) searched at each finer pyramid level.
+        :param reference_cache_size: Number of reference frames whose derived data (such as
+                                     pyramids) is kept for reuse.
+        :param predictors: Seed the 'three_step', 'diamond' and 'hexagon' searches from spatial and
+                           temporal motion-vector predictors instead of (0, 0).
+        :param zero_motion_threshold: With predictors, blocks whose zero-motion cost per pixel sample
+                                      is at most this value are marked static without searching.
+        :param early_termination_threshold: With predictors, blocks whose best predictor cost per
+                                            pixel sample is at most this value skip the search.
+        :param subpel: Sub-pixel refinement after the integer search: None, 'half' or 'quarter'.
+        :param search_plane: 'color' matches all channels; 'luma' converts RGB frames to a single
+                             Y plane once per frame and matches on that.
+        :param decimate: Run the search on 2x decimated planes first and refine the doubled
+                         vectors by +/- 1 pixel at full resolution.
+        :param workers: Number of workers evaluating bands of macroblock rows in parallel. The
+                        vectors are identical to the serial (workers=1) result.
+        :param parallel_backend: 'thread' or 'process'; process workers read the frames from
+                                 shared memory.
+        :param global_motion: Global (camera) motion pre-pass: None, 'translation' or 'affine'. The
+                              model is fitted to the vectors of a sparse grid of blocks and seeds the
+                              local search of every block.
+        :param global_motion_threshold: Blocks whose cost per pixel sample under the global model
+                                        is at most this value keep the model vector and skip the
+                                        local search.
+        :param global_motion_stride: Spacing (in macroblocks) of the sparse grid used to fit the model.
         """
+        if cost not in ('ssd', 'sad'):
+            raise ValueError(f"Unknown motion estimation cost '{cost}'. Use 'ssd' or 'sad'.")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown motion search strategy '{strategy}'. Use one of {self.STRATEGIES}.")
+        if block_size % (1 << (pyramid_levels - 1)) != 0:
+            raise ValueError(f"Block size {block_size} cannot be halved {pyramid_levels - 1} times for the pyramid.")
+        if subpel not in SUBPEL_PRECISION:
+            raise ValueError(f"Unknown sub-pixel mode '{subpel}'. Use None, 'half' or 'quarter'.")
+        if predictors and strategy in ('full', 'pyramid'):
+            raise ValueError(f"Motion-vector predictors are not used by the '{strategy}' strategy.")
+        if search_plane not in ('color', 'luma'):
+            raise ValueError(f"Unknown search plane '{search_plane}'. Use 'color' or 'luma'.")
+        if decimate and (strategy == 'pyramid' or block_size % 2 != 0):
+            raise ValueError("Decimated search needs an even block size and a non-pyramid strategy.")
+        if global_motion not in (None, 'translation', 'affine'):
+            raise ValueError(f"Unknown global motion model '{global_motion}'. Use None, 'translation' or 'affine'.")
+        if global_motion and (strategy == 'pyramid' or decimate or predictors):
+            raise ValueError("Global motion cannot be combined with the pyramid strategy, decimation or predictors.")
         self.search_range = search_range
         self.block_size = block_size
+        self.cost = cost
+        self.strategy = strategy
+        self.max_batch_elements = max_batch_elements
+        self.pyramid_levels = pyramid_levels
+        self.refine_range = refine_range
+        self.reference_cache_size = reference_cache_size
+        self.predictors = predictors
+        self.zero_motion_threshold = zero_motion_threshold
+        self.early_termination_threshold = early_termination_threshold
+        self.subpel = subpel
+        self.search_plane = search_plane
+        self.decimate = decimate
+        self.global_motion = global_motion
+        self.global_motion_threshold = global_motion_threshold
+        self.global_motion_stride = global_motion_stride
+        self.executor = BandExecutor(workers, parallel_backend)
+        # Per-reference derived data (pyramids, luma and decimated planes); interpolated planes
+        # live in the interpolator, which also serves motion compensation of the colour frames
+        self._reference_cache = ReferenceCache(reference_cache_size)
+        interpolator_cache_size = reference_cache_size * (2 if search_plane == 'luma' else 1)
+        self.interpolator = SubpelInterpolator(precision=SUBPEL_PRECISION[subpel], cache_size=interpolator_cache_size)
+        # Half-resolution search used for the coarse pass of a decimated search
+        self._coarse_estimator = None
+        if decimate:
+            self._coarse_estimator = MotionEstimator(
+                search_range=-(-search_range // 2), block_size=block_size // 2, cost=cost, strategy=strategy,
+                max_batch_elements=max_batch_elements, reference_cache_size=reference_cache_size,
+                predictors=predictors, zero_motion_threshold=zero_motion_threshold,
+                early_termination_threshold=early_termination_threshold, pyramid_levels=1)
+            self._coarse_estimator.executor = self.executor
+        # Vectors of the previous estimate_motion call, used as temporal predictors
+        self._previous_vectors = None
+        # Statistics of the last estimate_motion call
+        self.stats = {'strategy': strategy, 'blocks': 0, 'candidates_evaluated': 0}
+
+    def reset_motion_cache(self):
+        """
+        Forgets the motion vectors of the previous frame. Call at the start of a new sequence.
+        """
+        self._previous_vectors = None
+        if self._coarse_estimator is not None:
+            self._coarse_estimator.reset_motion_cache()
+
+    def close(self):
+        """
+        Shuts down the parallel workers, if any.
+        """
+        self.executor.close()
 
     def estimate_motion(self, reference_frame, target_frame):
         """
         Estimates motion vectors between a reference frame and a target frame.
-        
+
+        Every macroblock of the target frame is matched against displaced blocks of the
+        reference frame within the search range, using the configured search strategy.
+        The number of candidates evaluated is recorded in self.stats, and the vector field is
+        kept as the temporal predictor for the next call.
+
+        :param reference_frame: Previous frame (NumPy array).
+        :param target_frame: Current frame (NumPy array).
+        :return: List of motion vectors (dx, dy) for each macroblock in raster order. Applying a
+                 vector to a target block at (x, y) gives its prediction at (x + dx, y + dy) in the
+                 reference frame. With sub-pixel refinement the components are multiples of
+                 1/2 or 1/4 pixel.
+        """
+        with self.executor.session():
+            return self._estimate_motion(reference_frame, target_frame)
+
+    def _estimate_motion(self, reference_frame, target_frame):
+        """
+        Runs the configured search; see estimate_motion.
+        """
+        if self.strategy == 'pyramid':
+            return self.estimate_motion_hierarchical(reference_frame, target_frame)
+
+        reference_frame, target_frame = self._search_planes(reference_frame, target_frame)
+        if self.decimate:
+            return self._decimated_search(reference_frame, target_frame)
+
+        reference, target = self._prepare_frames(reference_frame, target_frame)
+        rows, cols = target.shape[0] // self.block_size, target.shape[1] // self.block_size
+
+        if self.global_motion:
+            blocks, block_y, block_x = self._split_blocks(target)
+            vectors, evaluated, extra_stats = self._global_motion_search(reference, target, blocks, block_y, block_x, rows, cols)
+            return self._finish(reference_frame, target, vectors, evaluated, **extra_stats)
+
+        if self.strategy == 'full':
+            vectors, evaluated = self._full_search(reference, target)
+            return self._finish(reference_frame, target, vectors, evaluated)
+
+        blocks, block_y, block_x = self._split_blocks(target)
+        if self.predictors:
+            vectors, evaluated, extra_stats = self._predictive_search(reference, blocks, block_y, block_x, rows, cols)
+            return self._finish(reference_frame, target, vectors, evaluated, **extra_stats)
+
+        vectors = np.zeros((len(blocks), 2), dtype=np.int64)
+        best_costs, evaluated = self._candidate_costs(reference, blocks, block_y, block_x, vectors[:, np.newaxis])
+        vectors, _, count = self._refine(reference, blocks, block_y, block_x, vectors, best_costs[:, 0])
+        return self._finish(reference_frame, target, vectors, evaluated + count)
+
+    def estimate_motion_hierarchical(self, reference_frame, target_frame):
+        """
+        Estimates motion vectors with a multi-resolution (Gaussian pyramid) search.
+
+        The coarsest level is searched exhaustively with the search range scaled down by the
+        pyramid factor; every finer level doubles the vectors of the level above and refines
+        them within +/- refine_range pixels. A large search range therefore costs about as much
+        as a small full search. The reference pyramid is built once per reference frame and
+        reused by every target frame predicted from it.
+
         :param reference_frame: Previous frame (NumPy array).
         :param target_frame: Current frame (NumPy array).
-        :return: List of motion vectors for each macroblock.
-        """
-        motion_vectors = []
-        height, width, channels = reference_frame.shape
-
-        for y in range(0, height, self.block_size):
-            for x in range(0, width, self.block_size):
-                ref_block = reference_frame[y:y+self.block_size, x:x+self.block_size]
-                min_ssd = float('inf')
-                mv = (0, 0)
-
-                # Define search window
-                for dy in range(-self.search_range, self.search_range + 1):
-                    for dx in range(-self.search_range, self.search_range + 1):
-                        ref_y = min(max(y + dy, 0), height - self.block_size)
-                        ref_x = min(max(x + dx, 0), width - self.block_size)
-                        search_block = target_frame[ref_y:ref_y+self.block_size, ref_x:ref_x+self.block_size]
-
-                        # Ensure both blocks are of the correct size
-                        if ref_block.shape != (self.block_size, self.block_size, channels):
-                            print(f"Incomplete reference block at ({y}, {x}) with shape {ref_block.shape}")
-                            continue
-                        if search_block.shape != (self.block_size, self.block_size, channels):
-                            print(f"Incomplete search block at ({ref_y}, {ref_x}) with shape {search_block.shape}")
-                            continue
-
-                        ssd = np.sum((ref_block - search_block) ** 2)
-                        if ssd < min_ssd:
-                            min_ssd = ssd
-                            mv = (dx, dy)
-                
-                motion_vectors.append(mv)
-        
-        return motion_vectors
+        :return: List of motion vectors (dx, dy) for each macroblock in raster order.
+        """
+        with self.executor.session():
+            return self._estimate_motion_hierarchical(reference_frame, target_frame)
+
+    def _estimate_motion_hierarchical(self, reference_frame, target_frame):
+        """
+        Runs the pyramid search; see estimate_motion_hierarchical.
+        """
+        reference_frame, target_frame = self._search_planes(reference_frame, target_frame)
+        reference_pyramid = self._reference_cache.get(reference_frame, 'pyramid', lambda: self._build_pyramid(reference_frame))
+        target_pyramid = self._build_pyramid(target_frame)
+
+        levels = len(reference_pyramid)
+        coarsest = levels - 1
+        coarse_range = -(-self.search_range // (1 << coarsest))
+        coarse_block = self.block_size >> coarsest
+        cost_volume, offsets = self._full_search_cost_volume(reference_pyramid[coarsest], target_pyramid[coarsest], coarse_range, coarse_block)
+        vectors = offsets[np.argmin(cost_volume, axis=0).ravel()]
+        evaluated = int(np.count_nonzero(cost_volume < self._invalid_cost))
+
+        window = np.arange(-self.refine_range, self.refine_range + 1)
+        refinement = np.stack(np.meshgrid(window, window, indexing='ij'), axis=-1).reshape(-1, 2)
+        for level in range(coarsest - 1, -1, -1):
+            block_size = self.block_size >> level
+            level_range = -(-self.search_range // (1 << level))
+            blocks, block_y, block_x = self._split_blocks(target_pyramid[level], block_size)
+            candidates = vectors[:, np.newaxis, :] * 2 + refinement[np.newaxis]
+            costs, count = self._candidate_costs(reference_pyramid[level], blocks, block_y, block_x, candidates, search_range=level_range)
+            evaluated += count
+            vectors = candidates[np.arange(len(candidates)), np.argmin(costs, axis=1)]
+
+        return self._finish(reference_frame, target_pyramid[0], vectors, evaluated, strategy='pyramid', pyramid_levels=levels)
+
+    def _search_planes(self, reference_frame, target_frame):
+        """
+        Returns the planes the search runs on: the frames themselves, or their luma planes.
+
+        The luma plane of the reference is cached, so it is converted once per reference frame.
+
+        :param reference_frame: Reference frame.
+        :param target_frame: Target frame.
+        :return: Tuple (reference_plane, target_plane).
+        """
+        if reference_frame.shape != target_frame.shape:
+            raise ValueError(f"Reference frame shape {reference_frame.shape} does not match target frame shape {target_frame.shape}")
+        if self.search_plane == 'color':
+            return reference_frame, target_frame
+        reference_luma = self._reference_cache.get(reference_frame, 'luma', lambda: self._luma(reference_frame))
+        return reference_luma, self._luma(target_frame)
+
+    @staticmethod
+    def _luma(frame):
+        """
+        Converts an RGB frame (as produced by ImageProcessor) to its Y plane.
+
+        :param frame: Frame (H x W x 3), or a single plane which is returned unchanged.
+        :return: uint8 luma plane (H x W).
+        """
+        if frame.ndim == 2:
+            return frame
+        if frame.shape[2] == 1:
+            return frame[:, :, 0]
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+    def _decimate(self, frame):
+        """
+        Crops a frame to whole macroblocks and downsamples it by 2 in both directions.
+
+        :param frame: Frame or plane.
+        :return: Half-resolution frame.
+        """
+        height = frame.shape[0] - frame.shape[0] % self.block_size
+        width = frame.shape[1] - frame.shape[1] % self.block_size
+        return cv2.resize(frame[:height, :width], (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+
+    def _decimated_search(self, reference_frame, target_frame):
+        """
+        Searches 2x decimated planes with half-size blocks, then refines the doubled vectors
+        within +/- 1 pixel at full resolution.
+
+        :param reference_frame: Reference plane.
+        :param target_frame: Target plane.
+        :return: List of motion vectors (dx, dy) in full-resolution units.
+        """
+        reference_half = self._reference_cache.get(reference_frame, 'decimated', lambda: self._decimate(reference_frame))
+        coarse = self._coarse_estimator.estimate_motion(reference_half, self._decimate(target_frame))
+        evaluated = self._coarse_estimator.stats['candidates_evaluated']
+
+        reference, target = self._prepare_frames(reference_frame, target_frame)
+        blocks, block_y, block_x = self._split_blocks(target)
+        centres = np.array([(dy, dx) for dx, dy in coarse], dtype=np.int64).reshape(-1, 2) * 2
+        window = np.vstack([np.zeros((1, 2), dtype=np.int64), SQUARE])
+        candidates = centres[:, np.newaxis, :] + window[np.newaxis]
+        costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates)
+        vectors = candidates[np.arange(len(candidates)), np.argmin(costs, axis=1)]
+        return self._finish(reference_frame, target, vectors, evaluated + count, decimated=True)
+
+    def _finish(self, reference_frame, target, vectors, evaluated, strategy=None, **extra_stats):
+        """
+        Applies the optional sub-pixel refinement, records statistics and the temporal predictor
+        field, and formats the vectors.
+
+        :param reference_frame: Original reference frame (used for the interpolated planes).
+        :param target: int32 target frame (H, W, C) cropped to whole macroblocks.
+        :param vectors: (N, 2) array of integer (dy, dx) vectors in raster order.
+        :param evaluated: Number of candidates evaluated.
+        :param strategy: Strategy name for the statistics (defaults to self.strategy).
+        :param extra_stats: Additional statistics to record.
+        :return: List of (dx, dy) tuples.
+        """
+        rows, cols = target.shape[0] // self.block_size, target.shape[1] // self.block_size
+        self._previous_vectors = vectors.reshape(rows, cols, 2).copy()
+        if self.subpel is not None:
+            vectors, count = self._subpel_refine(reference_frame, target, vectors)
+            evaluated += count
+        self.stats = {
+            'strategy': strategy or self.strategy,
+            'search_plane': self.search_plane,
+            'blocks': len(vectors),
+            'candidates_evaluated': evaluated,
+            'candidates_per_block': evaluated / max(len(vectors), 1),
+            **extra_stats,
+        }
+        if self.subpel is None:
+            return [(int(dx), int(dy)) for dy, dx in vectors]
+        precision = self.interpolator.precision
+        return [(dx / precision, dy / precision) for dy, dx in vectors.tolist()]
+
+    def _subpel_refine(self, reference_frame, target, vectors):
+        """
+        Refines integer vectors to half-pel, then (for quarter-pel) quarter-pel accuracy by
+        testing the 8 neighbours at each step size. Candidate blocks are gathered from the
+        interpolated planes, which are computed once per reference frame.
+
+        :param reference_frame: Original reference frame.
+        :param target: int32 target frame (H, W, C).
+        :param vectors: (N, 2) integer (dy, dx) vectors.
+        :return: Tuple (vectors, evaluated) with vectors in units of 1 / precision pixels.
+        """
+        precision = self.interpolator.precision
+        blocks, block_y, block_x = self._split_blocks(target)
+        vectors = vectors * precision
+        best_costs, evaluated = self._subpel_costs(reference_frame, target.shape, blocks, block_y, block_x, vectors[:, np.newaxis])
+        best_costs = best_costs[:, 0]
+        step = precision // 2
+        while step >= 1:
+            candidates = vectors[:, np.newaxis, :] + SQUARE[np.newaxis] * step
+            costs, count = self._subpel_costs(reference_frame, target.shape, blocks, block_y, block_x, candidates)
+            evaluated += count
+            vectors, best_costs = self._move_to_best(vectors, best_costs, candidates, costs)
+            step //= 2
+        return vectors, evaluated
+
+    def _subpel_costs(self, reference_frame, shape, blocks, block_y, block_x, displacements):
+        """
+        Evaluates fractional candidate displacements against the interpolated reference planes.
+
+        :param reference_frame: Original reference frame.
+        :param shape: Shape (H, W, C) of the cropped frames.
+        :param blocks: int32 target blocks (n, C, bs, bs).
+        :param block_y: Top row of every block (n,).
+        :param block_x: Left column of every block (n,).
+        :param displacements: (n, K, 2) candidates in units of 1 / precision pixels.
+        :return: Tuple (costs, evaluated) with costs of shape (n, K).
+        """
+        height, width, channels = shape
+        bs = self.block_size
+        precision = self.interpolator.precision
+        n, k, _ = displacements.shape
+        cand_y = block_y[:, np.newaxis] * precision + displacements[:, :, 0]
+        cand_x = block_x[:, np.newaxis] * precision + displacements[:, :, 1]
+        valid = (cand_y >= 0) & (cand_y <= (height - bs) * precision) & (cand_x >= 0) & (cand_x <= (width - bs) * precision)
+        valid &= (np.abs(displacements) <= self.search_range * precision).all(axis=-1)
+
+        planes = self.interpolator.planes(reference_frame)
+        block_index = np.repeat(np.arange(n), k)
+        phase_y, phase_x, y, x = self.interpolator.positions(planes, block_y[block_index], block_x[block_index],
+                                                            displacements.reshape(-1, 2), bs)
+        tasks = []
+        for start, stop in self.executor.split(n, self.executor.workers):
+            band = slice(start * k, stop * k)
+            tasks.append({'block_index': block_index[band], 'phase_y': phase_y[band], 'phase_x': phase_x[band],
+                          'y': y[band], 'x': x[band], 'cost': self.cost, 'max_batch_elements': self.max_batch_elements})
+        results = self.executor.map(_gather_subpel_costs, {'planes': planes, 'blocks': blocks}, tasks)
+        costs = np.concatenate(results).reshape(n, k) if results else np.empty((n, k), dtype=np.int64)
+        costs[~valid] = self._invalid_cost
+        return costs, int(np.count_nonzero(valid))
+
+    def _predictive_search(self, reference, blocks, block_y, block_x, rows, cols):
+        """
+        Predictor-seeded search with a zero-motion check and early termination.
+
+        1. Blocks whose zero-motion cost is below zero_motion_threshold are static and keep (0, 0).
+        2. The co-located vector of the previous frame is tried; blocks below
+           early_termination_threshold stop, the rest are refined with the configured pattern.
+        3. The median of the left, top and top-right vectors of that field is tried for the blocks
+           still searching, and refined from there when it is better.
+
+        Every step is evaluated for all blocks at once, so the result does not depend on the order
+        in which blocks are visited.
+
+        :return: Tuple (vectors, evaluated, extra_stats) with vectors of shape (N, 2) as (dy, dx).
+        """
+        samples = blocks[0].size
+        vectors = np.zeros((len(blocks), 2), dtype=np.int64)
+        best_costs, evaluated = self._candidate_costs(reference, blocks, block_y, block_x, vectors[:, np.newaxis])
+        best_costs = best_costs[:, 0]
+        static = best_costs <= self.zero_motion_threshold * samples
+
+        # Temporal predictor: co-located vector of the previous frame
+        searching = np.flatnonzero(~static)
+        if self._previous_vectors is not None and self._previous_vectors.shape == (rows, cols, 2) and searching.size:
+            temporal = self._previous_vectors.reshape(-1, 2)[searching, np.newaxis]
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, temporal, index=searching)
+            evaluated += count
+            vectors[searching], best_costs[searching] = self._move_to_best(vectors[searching], best_costs[searching], temporal, costs)
+
+        terminated = ~static & (best_costs <= self.early_termination_threshold * samples)
+        searching = np.flatnonzero(~static & ~terminated)
+        vectors[searching], best_costs[searching], count = self._refine(
+            reference, blocks, block_y, block_x, vectors[searching], best_costs[searching], searching)
+        evaluated += count
+
+        # Spatial predictor: median of the left, top and top-right vectors
+        median = self._median_predictors(vectors.reshape(rows, cols, 2)).reshape(-1, 2)
+        searching = searching[(median[searching] != vectors[searching]).any(axis=1)]
+        if searching.size:
+            candidates = median[searching, np.newaxis]
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates, index=searching)
+            evaluated += count
+            better = searching[costs[:, 0] < best_costs[searching]]
+            vectors[better] = median[better]
+            best_costs[better] = costs[costs[:, 0] < best_costs[searching], 0]
+            better = better[best_costs[better] > self.early_termination_threshold * samples]
+            vectors[better], best_costs[better], count = self._refine(
+                reference, blocks, block_y, block_x, vectors[better], best_costs[better], better)
+            evaluated += count
+
+        return vectors, evaluated, {'static_blocks': int(np.count_nonzero(static)),
+                                    'early_terminated': int(np.count_nonzero(terminated))}
+
+    def _global_motion_search(self, reference, target, blocks, block_y, block_x, rows, cols):
+        """
+        Global-motion pre-pass followed by the local search of the blocks the model does not fit.
+
+        1. The blocks of a sparse grid (every global_motion_stride-th row and column) are searched
+           exhaustively and a translation (median vector) or affine model (RANSAC) is fitted.
+        2. Every block evaluates the vector predicted by the model; blocks whose cost is at most
+           global_motion_threshold keep it and skip the local search.
+        3. The remaining blocks are searched exhaustively ('full'; the whole-frame cost volume is
+           used when most blocks remain), or refined with the configured pattern from the better
+           of the model vector and (0, 0).
+
+        :return: Tuple (vectors, evaluated, extra_stats) with vectors of shape (N, 2) as (dy, dx).
+        """
+        samples = blocks[0].size
+        bs = blocks.shape[-1]
+        height, width = reference.shape[:2]
+        window = np.arange(-self.search_range, self.search_range + 1)
+        offsets = np.stack(np.meshgrid(window, window, indexing='ij'), axis=-1).reshape(-1, 2)
+
+        stride = self.global_motion_stride
+        grid_rows = np.arange(min(stride // 2, rows - 1), rows, stride)
+        grid_cols = np.arange(min(stride // 2, cols - 1), cols, stride)
+        sparse = (grid_rows[:, np.newaxis] * cols + grid_cols[np.newaxis]).ravel()
+        costs, evaluated = self._candidate_costs(reference, blocks, block_y, block_x,
+                                                 np.broadcast_to(offsets, (len(sparse),) + offsets.shape), index=sparse)
+        sparse_vectors = offsets[np.argmin(costs, axis=1)]
+
+        # Model vector of every block, evaluated at the block centre
+        centres = np.stack([block_x, block_y], axis=1).astype(np.float32) + bs / 2
+        model = np.float32([[1, 0, 0], [0, 1, 0]])
+        model[:, 2] = np.median(sparse_vectors[:, ::-1], axis=0)
+        if self.global_motion == 'affine' and len(sparse) >= 3:
+            affine, _ = cv2.estimateAffine2D(centres[sparse], centres[sparse] + sparse_vectors[:, ::-1].astype(np.float32),
+                                             method=cv2.RANSAC, ransacReprojThreshold=1.0)
+            if affine is not None:
+                model = affine.astype(np.float32)
+        predicted = centres @ model[:, :2].T + model[:, 2] - centres
+        vectors = np.clip(np.rint(predicted[:, ::-1]), -self.search_range, self.search_range).astype(np.int64)
+        vectors[:, 0] = np.clip(vectors[:, 0], -block_y, height - bs - block_y)
+        vectors[:, 1] = np.clip(vectors[:, 1], -block_x, width - bs - block_x)
+
+        best_costs, count = self._candidate_costs(reference, blocks, block_y, block_x, vectors[:, np.newaxis])
+        evaluated += count
+        best_costs = best_costs[:, 0]
+        searching = np.flatnonzero(best_costs > self.global_motion_threshold * samples)
+
+        if searching.size > len(blocks) // 2 and self.strategy == 'full':
+            full_vectors, count = self._full_search(reference, target)
+            evaluated += count
+            vectors[searching] = full_vectors[searching]
+        elif searching.size and self.strategy == 'full':
+            candidates = np.broadcast_to(offsets, (searching.size,) + offsets.shape)
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates, index=searching)
+            evaluated += count
+            vectors[searching] = offsets[np.argmin(costs, axis=1)]
+        elif searching.size:
+            zero = np.zeros((searching.size, 1, 2), dtype=np.int64)
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, zero, index=searching)
+            evaluated += count
+            vectors[searching], best_costs[searching] = self._move_to_best(vectors[searching], best_costs[searching], zero, costs)
+            vectors[searching], best_costs[searching], count = self._refine(
+                reference, blocks, block_y, block_x, vectors[searching], best_costs[searching], searching)
+            evaluated += count
+
+        return vectors, evaluated, {'global_model': model.tolist(),
+                                    'global_skipped': len(blocks) - int(searching.size)}
+
+    @staticmethod
+    def _median_predictors(field):
+        """
+        Computes the component-wise median of the left, top and top-right neighbour vectors.
+
+        As in H.264, the top-left vector stands in for a missing top-right neighbour in the last
+        column, and the first row, which has no upper neighbours, uses the left vector.
+
+        :param field: (rows, cols, 2) vector field.
+        :return: (rows, cols, 2) predictor field.
+        """
+        left = np.zeros_like(field)
+        left[:, 1:] = field[:, :-1]
+        top = np.zeros_like(field)
+        top[1:] = field[:-1]
+        top_right = np.zeros_like(field)
+        top_right[1:, :-1] = field[:-1, 1:]
+        if field.shape[1] > 1:
+            top_right[1:, -1] = field[:-1, -2]
+        median = np.median(np.stack([left, top, top_right]), axis=0).astype(field.dtype)
+        median[0] = left[0]
+        return median
+
+    def _build_pyramid(self, frame):
+        """
+        Builds a Gaussian pyramid of a frame cropped to whole macroblocks.
+
+        :param frame: Frame (H x W or H x W x C).
+        :return: List of int32 (H / 2^l, W / 2^l, C) arrays, finest level first.
+        """
+        if frame.ndim == 2:
+            frame = frame[:, :, np.newaxis]
+        height = frame.shape[0] - frame.shape[0] % self.block_size
+        width = frame.shape[1] - frame.shape[1] % self.block_size
+        level = frame[:height, :width].astype(np.float32)
+        pyramid = [np.rint(level).astype(np.int32)]
+        for _ in range(self.pyramid_levels - 1):
+            level = cv2.pyrDown(level).reshape(level.shape[0] // 2, level.shape[1] // 2, -1)
+            pyramid.append(np.rint(level).astype(np.int32))
+        return pyramid
+
+    def _prepare_frames(self, reference_frame, target_frame):
+        """
+        Converts both frames to int32 (H, W, C) arrays cropped to whole macroblocks.
+
+        Working in a widened integer type keeps block differences from wrapping around,
+        which happens when uint8 frames are subtracted directly.
+
+        :param reference_frame: Reference frame (H x W or H x W x C).
+        :param target_frame: Target frame with the same shape.
+        :return: Tuple (reference, target) as int32 arrays.
+        """
+        if reference_frame.shape != target_frame.shape:
+            raise ValueError(f"Reference frame shape {reference_frame.shape} does not match target frame shape {target_frame.shape}")
+        frames = []
+        for frame in (reference_frame, target_frame):
+            if frame.ndim == 2:
+                frame = frame[:, :, np.newaxis]
+            height = frame.shape[0] - frame.shape[0] % self.block_size
+            width = frame.shape[1] - frame.shape[1] % self.block_size
+            frames.append(frame[:height, :width].astype(np.int32))
+        return frames[0], frames[1]
+
+    def _split_blocks(self, frame, block_size=None):
+        """
+        Splits a frame into an array of macroblocks in raster order.
+
+        :param frame: Array (H, W, C) with H and W multiples of the block size.
+        :param block_size: Block size (defaults to the macroblock size).
+        :return: Tuple (blocks, block_y, block_x) with blocks of shape (N, C, bs, bs) and the
+                 top-left pixel coordinates of every block.
+        """
+        height, width, channels = frame.shape
+        bs = block_size or self.block_size
+        rows, cols = height // bs, width // bs
+        blocks = frame.reshape(rows, bs, cols, bs, channels).transpose(0, 2, 4, 1, 3).reshape(-1, channels, bs, bs)
+        block_y, block_x = np.meshgrid(np.arange(rows) * bs, np.arange(cols) * bs, indexing='ij')
+        return blocks, block_y.ravel(), block_x.ravel()
+
+    def _candidate_costs(self, reference, blocks, block_y, block_x, displacements, centers=None, search_range=None,
+                         index=None):
+        """
+        Evaluates a set of candidate displacements for a set of blocks.
+
+        Candidate blocks are gathered from a strided sliding-window view of the reference,
+        so no per-candidate slicing happens in Python. Bands of blocks are evaluated by the
+        executor's workers, which get the frame's blocks and the reference once per frame
+        (see BandExecutor.session) and the indices of their blocks with every task.
+
+        :param reference: int32 reference frame (H, W, C).
+        :param blocks: int32 target blocks of the frame (N, C, bs, bs).
+        :param block_y: Top row of every block (N,).
+        :param block_x: Left column of every block (N,).
+        :param displacements: Candidate (dy, dx) displacements, shape (n, K, 2).
+        :param centers: Optional (n, 2) search-window centres; candidates further than the search
+                        range from their centre are invalid. Defaults to (0, 0).
+        :param search_range: Search range to enforce (defaults to self.search_range).
+        :param index: Indices of the n blocks to evaluate (defaults to all blocks).
+        :return: Tuple (costs, evaluated) with costs of shape (n, K) and the number of valid
+                 candidates evaluated.
+        """
+        height, width, channels = reference.shape
+        bs = blocks.shape[-1]
+        if index is None:
+            index = np.arange(len(blocks))
+
+        cand_y = block_y[index, np.newaxis] + displacements[:, :, 0]
+        cand_x = block_x[index, np.newaxis] + displacements[:, :, 1]
+        valid = (cand_y >= 0) & (cand_y <= height - bs) & (cand_x >= 0) & (cand_x <= width - bs)
+        if centers is None:
+            centers = np.zeros((len(index), 2), dtype=np.int64)
+        offsets = np.abs(displacements - centers[:, np.newaxis, :])
+        valid &= (offsets <= (search_range or self.search_range)).all(axis=-1)
+        cand_y = np.clip(cand_y, 0, height - bs)
+        cand_x = np.clip(cand_x, 0, width - bs)
+
+        n, k = cand_y.shape
+        tasks = [{'index': index[start:stop], 'cand_y': cand_y[start:stop], 'cand_x': cand_x[start:stop],
+                  'cost': self.cost, 'max_batch_elements': self.max_batch_elements}
+                 for start, stop in self.executor.split(n, self.executor.workers)]
+        results = self.executor.map(_gather_costs, {'reference': reference, 'blocks': blocks}, tasks)
+        costs = np.concatenate(results) if results else np.empty((n, k), dtype=np.int64)
+        costs[~valid] = self._invalid_cost
+        return costs, int(np.count_nonzero(valid))
+
+    def _full_search(self, reference, target):
+        """
+        Exhaustive search over the whole (2 * search_range + 1)^2 window.
+
+        :return: Tuple (vectors, evaluated) with vectors of shape (N, 2) as (dy, dx).
+        """
+        cost_volume, offsets = self._full_search_cost_volume(reference, target, self.search_range)
+        # np.argmin keeps the first minimum, i.e. the same tie-break as a dy-major scan
+        best = np.argmin(cost_volume, axis=0).ravel()
+        evaluated = int(np.count_nonzero(cost_volume < self._invalid_cost))
+        return offsets[best], evaluated
+
+    def _refine(self, reference, blocks, block_y, block_x, vectors, best_costs, index=None):
+        """
+        Runs the configured fast search strategy from the given starting vectors.
+
+        :param vectors: (n, 2) starting vectors as (dy, dx).
+        :param best_costs: (n,) costs of the starting vectors.
+        :param index: Indices of the n blocks to refine (defaults to all blocks).
+        :return: Tuple (vectors, best_costs, evaluated).
+        """
+        if index is None:
+            index = np.arange(len(blocks))
+        if self.strategy == 'three_step':
+            return self._three_step_search(reference, blocks, block_y, block_x, vectors, best_costs, index)
+        if self.strategy == 'diamond':
+            return self._pattern_search(reference, blocks, block_y, block_x, vectors, best_costs, index, LARGE_DIAMOND, SMALL_DIAMOND)
+        return self._pattern_search(reference, blocks, block_y, block_x, vectors, best_costs, index, LARGE_HEXAGON, SMALL_DIAMOND)
+
+    def _three_step_search(self, reference, blocks, block_y, block_x, vectors, best_costs, index):
+        """
+        Three-step search: evaluates the 8 neighbours at a coarse step around the current best,
+        moves there, halves the step and repeats until the step is one pixel.
+
+        :return: Tuple (vectors, best_costs, evaluated) with vectors of shape (n, 2) as (dy, dx).
+        """
+        evaluated = 0
+        step = 1 << max(int(np.ceil(np.log2(self.search_range + 1))) - 1, 0)
+        while step >= 1:
+            candidates = vectors[:, np.newaxis, :] + SQUARE[np.newaxis] * step
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates, index=index)
+            evaluated += count
+            vectors, best_costs = self._move_to_best(vectors, best_costs, candidates, costs)
+            step //= 2
+        return vectors, best_costs, evaluated
+
+    def _pattern_search(self, reference, blocks, block_y, block_x, vectors, best_costs, index, large_pattern, small_pattern):
+        """
+        Pattern search (diamond or hexagon): repeats the large pattern around the current best
+        until the centre wins, then refines once with the small pattern. All blocks step in
+        lockstep; blocks that have converged drop out of later iterations.
+
+        :param large_pattern: (K, 2) offsets of the large search pattern.
+        :param small_pattern: (K, 2) offsets of the final refinement pattern.
+        :return: Tuple (vectors, best_costs, evaluated) with vectors of shape (n, 2) as (dy, dx).
+        """
+        vectors = vectors.copy()
+        best_costs = best_costs.copy()
+        evaluated = 0
+        active = np.arange(len(index))
+        # Each large-pattern step moves at least one pixel, so the window bounds the iterations
+        for _ in range(2 * self.search_range):
+            if active.size == 0:
+                break
+            candidates = vectors[active, np.newaxis, :] + large_pattern[np.newaxis]
+            costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates, index=index[active])
+            evaluated += count
+            moved = costs.min(axis=1) < best_costs[active]
+            vectors[active], best_costs[active] = self._move_to_best(vectors[active], best_costs[active], candidates, costs)
+            active = active[moved]
+
+        candidates = vectors[:, np.newaxis, :] + small_pattern[np.newaxis]
+        costs, count = self._candidate_costs(reference, blocks, block_y, block_x, candidates, index=index)
+        evaluated += count
+        vectors, best_costs = self._move_to_best(vectors, best_costs, candidates, costs)
+        return vectors, best_costs, evaluated
+
+    @staticmethod
+    def _move_to_best(vectors, best_costs, candidates, costs):
+        """
+        Moves every block to its cheapest candidate if that strictly improves on the current best.
+
+        :param vectors: Current (n, 2) vectors.
+        :param best_costs: Current (n,) costs.
+        :param candidates: Evaluated (n, K, 2) candidates.
+        :param costs: Their (n, K) costs.
+        :return: Tuple (vectors, best_costs) after the move.
+        """
+        best = np.argmin(costs, axis=1)
+        candidate_costs = costs[np.arange(len(costs)), best]
+        improved = candidate_costs < best_costs
+        vectors = vectors.copy()
+        vectors[improved] = candidates[improved, best[improved]]
+        best_costs = np.where(improved, candidate_costs, best_costs)
+        return vectors, best_costs
+
+    def _full_search_cost_volume(self, reference, target, search_range, block_size=None):
+        """
+        Computes the matching cost of every block for every displacement in the search window.
+
+        The reference is edge-padded by the search range, so each displacement is a plain
+        view into the padded array. Bands of macroblock rows are evaluated by the executor's
+        workers. Displacements that would move a block outside the frame get an invalid
+        (maximal) cost.
+
+        :param reference: int32 reference frame (H, W, C).
+        :param target: int32 target frame (H, W, C).
+        :param search_range: Search range in pixels.
+        :param block_size: Block size (defaults to the macroblock size).
+        :return: Tuple (cost_volume, offsets) with cost_volume of shape (K, rows, cols) and
+                 offsets of shape (K, 2) holding (dy, dx) in dy-major order.
+        """
+        height, width, _ = target.shape
+        bs = block_size or self.block_size
+        rows, cols = height // bs, width // bs
+        padded = np.pad(reference, ((search_range, search_range), (search_range, search_range), (0, 0)), mode='edge')
+        block_y = np.arange(rows) * bs
+        block_x = np.arange(cols) * bs
+
+        displacements = np.arange(-search_range, search_range + 1)
+        offsets = np.stack(np.meshgrid(displacements, displacements, indexing='ij'), axis=-1).reshape(-1, 2)
+        tasks = [{'row_start': start, 'row_stop': stop, 'offsets': offsets, 'search_range': search_range,
+                  'block_size': bs, 'cost': self.cost}
+                 for start, stop in self.executor.split(rows, self.executor.workers)]
+        cost_volume = np.concatenate(self.executor.map(_band_cost_volume, {'padded': padded, 'target': target}, tasks), axis=1)
+
+        # Only keep candidates that lie fully inside the reference frame
+        valid_rows = (block_y[np.newaxis] + offsets[:, :1] >= 0) & (block_y[np.newaxis] + offsets[:, :1] <= height - bs)
+        valid_cols = (block_x[np.newaxis] + offsets[:, 1:] >= 0) & (block_x[np.newaxis] + offsets[:, 1:] <= width - bs)
+        cost_volume[~(valid_rows[:, :, np.newaxis] & valid_cols[:, np.newaxis, :])] = self._invalid_cost
+        return cost_volume, offsets
@@ -0,0 +1,104 @@
+# motion_vector_coder.py
+
+import numpy as np
+
+# Motion vectors are coded in quarter samples, which represents every search precision exactly
+VECTOR_PRECISION = 4
+
+
+class MotionVectorCoder:
+    @staticmethod
+    def to_units(motion_vectors, shape):
+        """
+        Converts (dx, dy) vectors in pixels to integer quarter-sample units.
+
+        :param motion_vectors: (dx, dy) per macroblock in raster order.
+        :param shape: (rows, cols) of the macroblock grid.
+        :return: int64 array (rows, cols, 2).
+        """
+        vectors = np.asarray(motion_vectors, dtype=np.float64).reshape(shape + (2,))
+        return np.rint(vectors * VECTOR_PRECISION).astype(np.int64)
+
+    @staticmethod
+    def to_vectors(units):
+        """
+        Converts quarter-sample units back to (dx, dy) vectors in pixels (inverse of to_units).
+
+        :param units: int array (rows, cols, 2).
+        :return: List of (dx, dy) tuples in raster order.
+        """
+        return [tuple(vector) for vector in (units.reshape(-1, 2) / VECTOR_PRECISION).tolist()]
+
+    @staticmethod
+    def _median(left, above, corner):
+        """
+        Returns the component-wise median of three vectors (or arrays of vectors).
+        """
+        return left + above + corner - np.minimum(np.minimum(left, above), corner) - np.maximum(np.maximum(left, above), corner)
+
+    @classmethod
+    def predictors(cls, units):
+        """
+        Predicts every vector from its neighbours as H.264 does: the component-wise median of
+        the vectors to the left, above and above-right (above-left in the last column). Vectors
+        outside the frame count as zero, except on the first row, which is predicted from the
+        vector to the left alone.
+
+        :param units: int array (rows, cols, 2) of vectors (zero for macroblocks without one).
+        :return: int64 array (rows, cols, 2) of predictors.
+        """
+        rows, cols = units.shape[:2]
+        padded = np.zeros((rows + 1, cols + 2, 2), dtype=np.int64)
+        padded[1:, 1:-1] = units
+        left, above = padded[1:, :-2], padded[:-1, 1:-1]
+        corner = padded[:-1, 2:].copy()
+        corner[:, -1] = padded[:-1, -3]
+        predicted = cls._median(left, above, corner)
+        predicted[0] = left[0]
+        return predicted
+
+    @classmethod
+    def encode(cls, units, coded, writer):
+        """
+        Writes the vectors of the macroblocks that carry one as signed Exp-Golomb differences
+        from their median predictors, x before y, in raster order.
+
+        :param units: int array (rows, cols, 2) of quarter-sample vectors.
+        :param coded: Boolean array (rows, cols) of the macroblocks that carry a vector; the
+                      others count as zero vectors for their neighbours' predictors.
+        :param writer: BitWriter the codes are appended to.
+        :return: The vectors as the decoder sees them (zero where not coded).
+        """
+        units = np.where(coded[..., np.newaxis], units, 0)
+        writer.write_exp_golomb((units - cls.predictors(units))[coded], signed=True)
+        return units
+
+    @classmethod
+    def decode(cls, reader, coded):
+        """
+        Reads the vectors written by encode. Every predictor depends on the vector decoded just
+        before it, so the differences are read at once and the vectors rebuilt in raster order.
+
+        :param reader: BitReader positioned at the vectors.
+        :param coded: Boolean array (rows, cols) of the macroblocks that carry a vector.
+        :return: int64 array (rows, cols, 2) of quarter-sample vectors (zero where not coded).
+        """
+        rows, cols = coded.shape
+        differences = np.zeros((rows, cols, 2), dtype=np.int64)
+        differences[coded] = reader.read_exp_golomb(2 * int(coded.sum()), signed=True).reshape(-1, 2)
+        # Padded like in predictors: a zero row above and a zero column on either side
+        units = [[(0, 0)] * (cols + 2) for _ in range(rows + 1)]
+        for row in range(rows):
+            above, current = units[row], units[row + 1]
+            for col in range(cols):
+                if not coded[row, col]:
+                    continue
+                left = current[col]
+                if row == 0:
+                    predicted = left
+                else:
+                    corner = above[col + 2] if col + 1 < cols else above[col]
+                    predicted = tuple(sorted(components)[1] for components in zip(left, above[col + 1], corner))
+                dx, dy = differences[row, col]
+                current[col + 1] = (predicted[0] + int(dx), predicted[1] + int(dy))
+        return np.array([line[1:-1] for line in units[1:]], dtype=np.int64).reshape(rows, cols, 2)
@@ -0,0 +1,113 @@
+# opencv_motion_estimator.py
+
+import numpy as np
+import cv2
+from motion_estimator import MotionEstimator, SQUARE
+
+
+def _match_template_band(reference, target, block_y, block_x, search_range, block_size):
+    """
+    Finds the best integer vector of a band of blocks with cv2.matchTemplate.
+
+    Each block is matched (TM_SQDIFF, i.e. SSD) against its search window, clipped to the
+    reference frame, so every position OpenCV evaluates is a valid candidate.
+
+    :param reference: uint8 reference frame (H, W, C).
+    :param target: uint8 target frame (H, W, C).
+    :param block_y: Top row of every block in the band (n,).
+    :param block_x: Left column of every block in the band (n,).
+    :param search_range: Search range in pixels.
+    :param block_size: Block size.
+    :return: Tuple (vectors, evaluated) with (n, 2) integer (dy, dx) vectors.
+    """
+    height, width = reference.shape[:2]
+    bs = block_size
+    vectors = np.zeros((len(block_y), 2), dtype=np.int64)
+    evaluated = 0
+    for i, (y, x) in enumerate(zip(block_y.tolist(), block_x.tolist())):
+        top, left = max(y - search_range, 0), max(x - search_range, 0)
+        bottom, right = min(y + bs + search_range, height), min(x + bs + search_range, width)
+        scores = cv2.matchTemplate(reference[top:bottom, left:right], target[y:y + bs, x:x + bs], cv2.TM_SQDIFF)
+        _, _, (u, v), _ = cv2.minMaxLoc(scores)
+        vectors[i] = (top + v - y, left + u - x)
+        evaluated += scores.size
+    return vectors, evaluated
+
+
+class OpenCVMotionEstimator(MotionEstimator):
+    STRATEGIES = ('full', 'optical_flow')
+
+    def __init__(self, search_range=8, block_size=16, strategy='full', reference_cache_size=2, subpel=None,
+                 search_plane='color', workers=1, parallel_backend='thread'):
+        """
+        Initializes the OpenCVMotionEstimator.
+
+        Same estimate_motion contract as MotionEstimator, but the block matching runs in
+        OpenCV's native code instead of NumPy.
+
+        :param search_range: Range of pixels to search for motion (default is 8).
+        :param block_size: Size of the macroblocks (default is 16x16).
+        :param strategy: 'full' matches every block over its whole search window with
+                         cv2.matchTemplate; 'optical_flow' averages dense Farneback flow over each
+                         macroblock and refines the rounded vector by +/- 1 pixel.
+        :param reference_cache_size: Number of reference frames whose derived data is kept.
+        :param subpel: Sub-pixel refinement after the integer search: None, 'half' or 'quarter'.
+        :param search_plane: 'color' matches all channels; 'luma' matches the Y plane only.
+                             Optical flow always runs on luma.
+        :param workers: Number of workers matching bands of macroblock rows in parallel.
+        :param parallel_backend: 'thread' or 'process'.
+        """
+        super().__init__(search_range=search_range, block_size=block_size, cost='ssd', strategy=strategy,
+                         pyramid_levels=1, reference_cache_size=reference_cache_size, subpel=subpel,
+                         search_plane=search_plane, workers=workers, parallel_backend=parallel_backend)
+
+    def _estimate_motion(self, reference_frame, target_frame):
+        """
+        Runs the configured OpenCV search; see estimate_motion.
+        """
+        if self.strategy == 'optical_flow':
+            return self._optical_flow_search(reference_frame, target_frame)
+
+        reference_plane, target_plane = self._search_planes(reference_frame, target_frame)
+        reference, target = self._prepare_frames(reference_plane, target_plane)
+        _, block_y, block_x = self._split_blocks(target)
+        tasks = [{'block_y': block_y[start:stop], 'block_x': block_x[start:stop],
+                  'search_range': self.search_range, 'block_size': self.block_size}
+                 for start, stop in self.executor.split(len(block_y), self.executor.workers)]
+        results = self.executor.map(_match_template_band, {'reference': reference.astype(np.uint8),
+                                                           'target': target.astype(np.uint8)}, tasks)
+        vectors = np.concatenate([band_vectors for band_vectors, _ in results])
+        evaluated = sum(count for _, count in results)
+        return self._finish(reference_plane, target, vectors, evaluated, backend='opencv')
+
+    def _optical_flow_search(self, reference_frame, target_frame):
+        """
+        Estimates one vector per macroblock from dense Farneback optical flow.
+
+        The flow is computed from the target to the reference, so it points to where each
+        target pixel is found in the reference, and is averaged over every macroblock.
+
+        :param reference_frame: Reference frame.
+        :param target_frame: Target frame.
+        :return: List of motion vectors (dx, dy) for each macroblock in raster order.
+        """
+        reference_plane, target_plane = self._search_planes(reference_frame, target_frame)
+        reference, target = self._prepare_frames(reference_plane, target_plane)
+        height, width = target.shape[:2]
+        bs = self.block_size
+        reference_luma = self._reference_cache.get(
+            reference_plane, 'flow_luma', lambda: self._luma(reference.astype(np.uint8)))
+        flow = cv2.calcOpticalFlowFarneback(self._luma(target.astype(np.uint8)), reference_luma, None,
+                                            0.5, 3, 15, 3, 5, 1.2, 0)
+        # Mean (dx, dy) of every macroblock, rounded and limited to the search range
+        mean_flow = flow.reshape(height // bs, bs, width // bs, bs, 2).mean(axis=(1, 3)).reshape(-1, 2)
+        centres = np.clip(np.rint(mean_flow[:, ::-1]), -self.search_range, self.search_range).astype(np.int64)
+
+        blocks, block_y, block_x = self._split_blocks(target)
+        centres[:, 0] = np.clip(centres[:, 0], -block_y, height - bs - block_y)
+        centres[:, 1] = np.clip(centres[:, 1], -block_x, width - bs - block_x)
+        window = np.vstack([np.zeros((1, 2), dtype=np.int64), SQUARE])
+        candidates = centres[:, np.newaxis, :] + window[np.newaxis]
+        costs, evaluated = self._candidate_costs(reference, blocks, block_y, block_x, candidates)
+        vectors = candidates[np.arange(len(candidates)), np.argmin(costs, axis=1)]
+        return self._finish(reference_plane, target, vectors, evaluated, backend='opencv')
@@ -0,0 +1,106 @@
+# quantization_tables.py
+
+import numpy as np
+import cv2
+
+# Perceptual quantization tables for 8x8 DCT blocks (JPEG, ITU-T T.81 Annex K)
+JPEG_LUMA_TABLE = np.array([
+    [16, 11, 10, 16, 24, 40, 51, 61],
+    [12, 12, 14, 19, 26, 58, 60, 55],
+    [14, 13, 16, 24, 40, 57, 69, 56],
+    [14, 17, 22, 29, 51, 87, 80, 62],
+    [18, 22, 37, 56, 68, 109, 103, 77],
+    [24, 35, 55, 64, 81, 104, 113, 92],
+    [49, 64, 78, 87, 103, 121, 120, 101],
+    [72, 92, 95, 98, 112, 100, 103, 99],
+], dtype=np.float32)
+
+JPEG_CHROMA_TABLE = np.array([
+    [17, 18, 24, 47, 99, 99, 99, 99],
+    [18, 21, 26, 66, 99, 99, 99, 99],
+    [24, 26, 56, 99, 99, 99, 99, 99],
+    [47, 66, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+], dtype=np.float32)
+
+BASE_TABLES = {'luma': JPEG_LUMA_TABLE, 'chroma': JPEG_CHROMA_TABLE}
+
+
+class QuantizationTables:
+    # Tables built so far, keyed by (quality, block shape, plane, normalized)
+    _cache = {}
+
+    @classmethod
+    def table(cls, quality, block_size=8, plane='luma', normalized=False):
+        """
+        Returns the quantization table for a quality, transform block size and plane.
+
+        The base table is scaled with the IJG quality formula (50 keeps it unchanged, lower
+        qualities coarsen it, higher ones refine it). For transform sizes other than 8x8 it is
+        resampled over the frequency axes and scaled with the orthonormal DCT gain, so a given
+        quality gives about the same step size per frequency at every block size. Tables are
+        built once and shared; they are read-only.
+
+        :param quality: Quality in 1..100 (values outside are clamped).
+        :param block_size: Transform block size, or a (height, width) tuple.
+        :param plane: 'luma' or 'chroma'.
+        :param normalized: Divide the table by 255 for transforms of samples scaled to [0, 1].
+        :return: float32 array (height, width).
+        """
+        if plane not in BASE_TABLES:
+            raise ValueError(f"Unknown quantization plane '{plane}'. Use 'luma' or 'chroma'.")
+        shape = (block_size, block_size) if np.isscalar(block_size) else tuple(block_size)
+        key = (quality, shape, plane, normalized)
+        if key not in cls._cache:
+            table = cls._build(quality, shape, plane)
+            if normalized:
+                table = table / 255.0
+            table.setflags(write=False)
+            cls._cache[key] = table
+        return cls._cache[key]
+
+    @staticmethod
+    def _build(quality, shape, plane):
+        """
+        Builds a quality-scaled table (see table()).
+
+        :param quality: Quality in 1..100.
+        :param shape: (height, width) of the transform block.
+        :param plane: 'luma' or 'chroma'.
+        :return: float32 array of the given shape.
+        """
+        quality = int(np.clip(quality, 1, 100))
+        scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+        table = np.clip(np.floor((BASE_TABLES[plane] * scale + 50) / 100), 1, 255)
+        height, width = shape
+        if (height, width) != table.shape:
+            table = cv2.resize(table, (width, height), interpolation=cv2.INTER_LINEAR) * np.sqrt(height * width) / 8
+        return table.astype(np.float32)
+
+    @classmethod
+    def stack(cls, quality, block_size, planes):
+        """
+        Returns the tables of several channels stacked along a last axis, for quantizing block
+        tensors laid out as (..., block_size, block_size, C). Cached like table().
+
+        :param quality: Quality in 1..100.
+        :param block_size: Transform block size.
+        :param planes: Plane of every channel, e.g. ('luma', 'chroma', 'chroma').
+        :return: float32 array (block_size, block_size, C).
+        """
+        key = (quality, (block_size, block_size), tuple(planes), 'stack')
+        if key not in cls._cache:
+            stacked = np.stack([cls.table(quality, block_size, plane) for plane in planes], axis=-1)
+            stacked.setflags(write=False)
+            cls._cache[key] = stacked
+        return cls._cache[key]
+
+    @classmethod
+    def clear(cls):
+        """
+        Drops all cached tables.
+        """
+        cls._cache.clear()
@@ -0,0 +1,277 @@
+# rate_controller.py
+
+import numpy as np
+
+# Bit budget weight of every frame type: references carry more detail than the B-frames predicted from them
+FRAME_WEIGHTS = {'I': 4.0, 'P': 2.0, 'B': 1.0}
+
+# Initial exponent of the rate model bits = complexity * scale ** -exponent per frame type, where scale
+# is the IJG quality scale of the quantization tables (measured on natural sequences: residuals fall
+# faster). A frame coded at two qualities measures its type's exponent, kept within EXPONENT_RANGE.
+MODEL_EXPONENTS = {'I': 0.6, 'P': 0.8, 'B': 0.8}
+EXPONENT_RANGE = (0.3, 4.0)
+
+# Largest factor by which the quantizer scale moves in one step: from one frame of a type to the
+# next, and from a probe to its retry (a single point fixes the complexity, not the exponent, so
+# a long extrapolation from it overshoots)
+MAX_FRAME_STEP = 2.0
+MAX_PROBE_STEP = 4.0
+
+
+class RateController:
+    def __init__(self, frame_types, target_bitrate=None, byte_budget=None, frame_rate=30, initial_quality=75,
+                 min_quality=5, max_quality=98, frame_weights=None, smoothing=0.5, tolerance=0.25,
+                 overshoot=2.0, max_retries=2):
+        """
+        Initializes the RateController.
+
+        Spreads a bit budget over the frames of a sequence and picks the quality of every frame
+        from a rate model per frame type, bits = complexity * scale ** -exponent. The complexity
+        of a type is re-estimated from the bits every coded frame actually produced, and each
+        frame gets the share of the remaining budget given by its type's weight, so earlier
+        overshoots or savings are corrected by the frames that follow; the exponent of a type
+        is re-estimated from every frame coded more than once. The first frame of each
+        type starts from the model of the type coded last; it is coded again if it misses its
+        budget, as is any frame that overshoots it by far (e.g. at a scene change), and the
+        coding closest to the budget is kept (see probe_quality).
+
+        :param frame_types: Types ('I', 'P' or 'B') of all frames to encode, in coding order.
+        :param target_bitrate: Target bitrate in bits per second.
+        :param byte_budget: Size budget of the compressed data in bytes (instead of target_bitrate).
+        :param frame_rate: Frame rate, to convert the bitrate to a budget.
+        :param initial_quality: Quality of the first frame, before any type has a model.
+        :param min_quality: Lowest quality the controller may choose.
+        :param max_quality: Highest quality the controller may choose.
+        :param frame_weights: Budget weight per frame type (defaults to FRAME_WEIGHTS).
+        :param smoothing: Weight of the previous complexity estimate when a new frame is measured (0..1).
+        :param tolerance: Relative budget miss above which the first frame of a type is coded again
+                          (see probe_quality).
+        :param overshoot: Factor of its budget above which a frame whose type has a model is coded again.
+        :param max_retries: Number of times a frame may be coded again.
+        """
+        if (target_bitrate is None) == (byte_budget is None):
+            raise ValueError("Give either a target bitrate or a byte budget.")
+        self.frame_types = list(frame_types)
+        self.frame_rate = frame_rate
+        self.target_bits = byte_budget * 8 if byte_budget is not None else target_bitrate * len(self.frame_types) / frame_rate
+        self.initial_quality = initial_quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.frame_weights = dict(FRAME_WEIGHTS, **(frame_weights or {}))
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.overshoot = overshoot
+        self.max_retries = max_retries
+
+        self.complexity = {}
+        self.exponents = dict(MODEL_EXPONENTS)
+        self.coded_bits = 0
+        self.coded_frames = 0
+        self.qualities = {}
+        self.last_quality = initial_quality
+        self.last_type = None
+
+    @staticmethod
+    def quality_scale(quality):
+        """
+        Returns the IJG scale factor (in percent) applied to the base tables at a quality.
+
+        :param quality: Quality in 1..100.
+        :return: Scale factor.
+        """
+        quality = np.clip(quality, 1, 100)
+        return 5000 / quality if quality < 50 else 200 - 2 * quality
+
+    @staticmethod
+    def scale_quality(scale):
+        """
+        Returns the quality whose IJG scale factor is the given one (inverse of quality_scale).
+
+        :param scale: Scale factor.
+        :return: Quality (not rounded).
+        """
+        return 5000 / scale if scale >= 100 else (200 - scale) / 2
+
+    def frame_budget(self):
+        """
+        Returns the bit budget of the next frame: its weighted share of the remaining budget.
+
+        :return: Budget in bits (at least one bit per frame left).
+        """
+        remaining_types = self.frame_types[self.coded_frames:]
+        total_weight = sum(self.frame_weights[frame_type] for frame_type in remaining_types)
+        remaining_bits = max(self.target_bits - self.coded_bits, len(remaining_types))
+        return remaining_bits * self.frame_weights[remaining_types[0]] / total_weight
+
+    def frame_quality(self):
+        """
+        Chooses the quality of the next frame. The quantizer scale moves by at most
+        MAX_FRAME_STEP from the previous frame of the same type.
+
+        :return: Integer quality in min_quality..max_quality.
+        """
+        frame_type = self.frame_types[self.coded_frames]
+        complexity = self.complexity.get(frame_type) or self.prior_complexity(frame_type)
+        if complexity is None:
+            return int(self.initial_quality)
+        exponent = self.exponents[frame_type]
+        scale = (complexity / self.frame_budget()) ** (1 / exponent)
+        if frame_type in self.qualities:
+            last_scale = self.quality_scale(self.qualities[frame_type])
+            scale = np.clip(scale, last_scale / MAX_FRAME_STEP, last_scale * MAX_FRAME_STEP)
+        quality = self.scale_quality(scale)
+        return int(np.clip(round(quality), self.min_quality, self.max_quality))
+
+    def prior_complexity(self, frame_type):
+        """
+        Estimates the complexity of a type without a model from the type coded last, assuming
+        that at the last frame's quality the types produce bits in the ratio of their weights.
+
+        :param frame_type: 'I', 'P' or 'B'.
+        :return: Complexity, or None before the first frame.
+        """
+        if self.last_type is None:
+            return None
+        scale = self.quality_scale(self.last_quality)
+        bits = (self.complexity[self.last_type] * scale ** -self.exponents[self.last_type]
+                * self.frame_weights[frame_type] / self.frame_weights[self.last_type])
+        return bits * scale ** self.exponents[frame_type]
+
+    def probe_quality(self, probes):
+        """
+        Checks the codings of the next frame so far against its budget and chooses the quality
+        to code it again with. The first frame of a type is coded again if it misses its budget
+        by more than `tolerance`, any other frame only if it overshoots by more than `overshoot`.
+        Once codings lie on either side of the budget, the retry interpolates between the
+        closest of them (log bits against log scale); until then it follows the type's rate
+        model from the closest coding, moving the scale by at most MAX_PROBE_STEP.
+
+        :param probes: List of (quality, bits) of the codings of the frame, in coding order.
+        :return: Quality to code the frame again with, or None to keep the closest coding
+                 (see closest).
+        """
+        frame_type = self.frame_types[self.coded_frames]
+        budget = self.frame_budget()
+        quality, bits = self.closest(probes)
+        if len(probes) > self.max_retries or abs(bits - budget) <= self.tolerance * budget:
+            return None
+        if frame_type in self.complexity and len(probes) == 1 and bits <= self.overshoot * budget:
+            return None
+        over = [probe for probe in probes if probe[1] > budget]
+        under = [probe for probe in probes if probe[1] < budget]
+        if over and under:
+            high_quality, high_bits = min(over, key=lambda probe: probe[1])
+            low_quality, low_bits = max(under, key=lambda probe: probe[1])
+            high_scale, low_scale = np.log(self.quality_scale(high_quality)), np.log(self.quality_scale(low_quality))
+            fraction = np.log(high_bits / budget) / np.log(high_bits / low_bits)
+            scale = np.exp(high_scale + fraction * (low_scale - high_scale))
+        else:
+            step = (bits / budget) ** (1 / self.exponents[frame_type])
+            scale = self.quality_scale(quality) * np.clip(step, 1 / MAX_PROBE_STEP, MAX_PROBE_STEP)
+        retry = int(np.clip(round(self.scale_quality(scale)), self.min_quality, self.max_quality))
+        return None if retry in [probe[0] for probe in probes] else retry
+
+    def closest(self, probes):
+        """
+        Returns the coding of the next frame that lands closest to its budget.
+
+        :param probes: List of (quality, bits) of the codings of the frame.
+        :return: (quality, bits) of the closest coding.
+        """
+        budget = self.frame_budget()
+        return min(probes, key=lambda probe: abs(probe[1] - budget))
+
+    def fit_exponent(self, probes):
+        """
+        Measures the exponent of the rate model from two codings of a frame: the closest ones
+        on either side of its budget if there are such, else the two closest to it.
+
+        :param probes: List of (quality, bits) of the codings of the frame.
+        :return: Exponent within EXPONENT_RANGE, or None if the codings do not fix one.
+        """
+        budget = self.frame_budget()
+        over = [probe for probe in probes if probe[1] > budget]
+        under = [probe for probe in probes if probe[1] <= budget]
+        if over and under:
+            pair = [min(over, key=lambda probe: probe[1]), max(under, key=lambda probe: probe[1])]
+        else:
+            pair = sorted(probes, key=lambda probe: abs(probe[1] - budget))[:2]
+        if len(pair) < 2 or self.quality_scale(pair[0][0]) == self.quality_scale(pair[1][0]):
+            return None
+        (first_quality, first_bits), (second_quality, second_bits) = pair
+        exponent = (np.log(max(first_bits, 1) / max(second_bits, 1))
+                    / np.log(self.quality_scale(second_quality) / self.quality_scale(first_quality)))
+        return float(np.clip(exponent, *EXPONENT_RANGE))
+
+    def update(self, quality, bits, probes=None):
+        """
+        Records the bits the next frame produced at a quality and updates its type's model.
+
+        :param quality: Quality the frame was coded with.
+        :param bits: Bits of the coded frame, including padding.
+        :param probes: List of (quality, bits) of all codings of the frame (see probe_quality);
+                       two or more re-estimate the exponent of its type.
+        """
+        frame_type = self.frame_types[self.coded_frames]
+        exponent = self.fit_exponent(probes) if probes is not None else None
+        if exponent is not None:
+            # The complexities measured with the old exponent no longer fit the model
+            self.exponents[frame_type] = self.smoothing * self.exponents[frame_type] + (1 - self.smoothing) * exponent
+            self.complexity.pop(frame_type, None)
+        complexity = max(bits, 1) * self.quality_scale(quality) ** self.exponents[frame_type]
+        if frame_type in self.complexity:
+            complexity = np.exp(self.smoothing * np.log(self.complexity[frame_type]) + (1 - self.smoothing) * np.log(complexity))
+        self.complexity[frame_type] = complexity
+        self.coded_bits += bits
+        self.coded_frames += 1
+        self.qualities[frame_type] = quality
+        self.last_quality = quality
+        self.last_type = frame_type
+
+    def report(self):
+        """
+        Summarizes the target and the bits produced so far.
+
+        :return: Dict with target and achieved bits and bitrates (bits per second).
+        """
+        duration = max(self.coded_frames, 1) / self.frame_rate
+        return {
+            'target_bits': int(self.target_bits),
+            'coded_bits': int(self.coded_bits),
+            'target_bitrate': self.target_bits / (len(self.frame_types) / self.frame_rate),
+            'achieved_bitrate': self.coded_bits / duration,
+        }
+
+
+def test_rate_control(byte_budget=20000, tolerance=0.15):
+    import os
+    import tempfile
+    import cv2
+    from video_encoder import VideoEncoder
+    # Smooth random texture panning by (2, 1) pixels per frame
+    rng = np.random.default_rng(0)
+    texture = cv2.GaussianBlur(rng.integers(0, 256, (300, 400, 3)).astype(np.float32), (0, 0), 3)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        input_folder = os.path.join(folder, 'frames')
+        os.mkdir(input_folder)
+        for k in range(8):
+            cv2.imwrite(os.path.join(input_folder, f'frame_{k:02d}.png'), texture[k:k + 240, 2 * k:2 * k + 320])
+        encoder = VideoEncoder(input_folder, os.path.join(folder, 'output.mp4'), os.path.join(folder, 'metadata.json'),
+                               (320, 240), gop_size=4, byte_budget=byte_budget)
+        # The compressed data is written to the working directory
+        os.chdir(folder)
+        try:
+            encoder.encode_video()
+        finally:
+            os.chdir(working_directory)
+        size = os.path.getsize(os.path.join(folder, 'compressed_data.bin'))
+
+    miss = size / byte_budget - 1
+    print(f"Rate control: {size} bytes for a budget of {byte_budget} ({miss:+.1%}).")
+    assert abs(miss) <= tolerance, f"Rate control missed the budget by {miss:+.1%}"
+
+
+if __name__ == "__main__":
+    test_rate_control()
@@ -0,0 +1,41 @@
+# reference_cache.py
+
+class ReferenceCache:
+    def __init__(self, size=2):
+        """
+        Initializes the ReferenceCache.
+
+        Keeps data derived from reference frames (pyramids, interpolated planes, ...) so it is
+        built once per reference frame and reused by every frame that predicts from it.
+        Entries are keyed by the identity of the reference array, so a reference must not be
+        modified in place while it is in use.
+
+        :param size: Number of reference frames kept; the oldest is evicted first.
+        """
+        self.size = size
+        self._entries = {}
+
+    def get(self, reference_frame, key, build):
+        """
+        Returns data derived from a reference frame, building it on first use.
+
+        :param reference_frame: Reference frame array.
+        :param key: Name of the derived data (e.g. 'pyramid').
+        :param build: Callable that computes the data.
+        :return: The cached or freshly built data.
+        """
+        entry = self._entries.get(id(reference_frame))
+        if entry is None or entry['frame'] is not reference_frame:
+            entry = {'frame': reference_frame}
+            self._entries[id(reference_frame)] = entry
+            while len(self._entries) > self.size:
+                del self._entries[next(iter(self._entries))]
+        if key not in entry:
+            entry[key] = build()
+        return entry[key]
+
+    def clear(self):
+        """
+        Drops all cached reference data.
+        """
+        self._entries.clear()
@@ -0,0 +1,155 @@
+# subpel_interpolator.py
+
+import numpy as np
+from reference_cache import ReferenceCache
+
+# H.264 six-tap half-sample filter
+HALF_PEL_TAPS = np.array([1, -5, 20, 20, -5, 1], dtype=np.float32) / 32
+
+
+class SubpelInterpolator:
+    def __init__(self, precision=4, margin=4, cache_size=2):
+        """
+        Initializes the SubpelInterpolator.
+
+        Half-sample positions are interpolated with the H.264 six-tap filter and quarter-sample
+        positions by averaging the neighbouring integer/half samples. All phase planes of a
+        reference frame are computed once and cached, so motion search and motion compensation
+        only gather from them.
+
+        :param precision: Vector precision as a fraction of a pixel: 1 (integer), 2 (half-pel)
+                          or 4 (quarter-pel).
+        :param margin: Edge-replicated border (in pixels) added around each reference frame.
+        :param cache_size: Number of reference frames whose planes are kept.
+        """
+        if precision not in (1, 2, 4):
+            raise ValueError(f"Unsupported sub-pixel precision {precision}. Use 1, 2 or 4.")
+        self.precision = precision
+        self.margin = margin
+        self.cache = ReferenceCache(cache_size)
+
+    def planes(self, reference_frame):
+        """
+        Returns the interpolated phase planes of a reference frame, computing them on first use.
+
+        :param reference_frame: Reference frame (H x W or H x W x C, 8-bit samples).
+        :return: uint8 array (P, P, H', W', C) where plane [fy, fx] at (margin + y, margin + x)
+                 holds the sample at (y + fy / P, x + fx / P).
+        """
+        return self.cache.get(reference_frame, ('planes', self.precision), lambda: self._build_planes(reference_frame))
+
+    def _build_planes(self, frame):
+        """
+        Computes all phase planes of a frame.
+
+        :param frame: Reference frame (H x W or H x W x C).
+        :return: uint8 array (P, P, H', W', C).
+        """
+        if frame.ndim == 2:
+            frame = frame[:, :, np.newaxis]
+        m = self.margin
+        padded = np.pad(frame.astype(np.float32), ((m, m), (m, m), (0, 0)), mode='edge')
+        if self.precision == 1:
+            return padded.astype(np.uint8)[np.newaxis, np.newaxis]
+
+        # Half-sample grid: even/odd rows and columns hold integer/half positions
+        horizontal = self._half_samples(padded, axis=1)
+        vertical = self._half_samples(padded, axis=0)
+        centre = self._half_samples(horizontal, axis=0)
+        height, width, channels = padded.shape
+        grid = np.empty((2 * height, 2 * width, channels), dtype=np.int32)
+        grid[0::2, 0::2] = np.rint(padded)
+        grid[0::2, 1::2] = np.clip(np.rint(horizontal), 0, 255)
+        grid[1::2, 0::2] = np.clip(np.rint(vertical), 0, 255)
+        grid[1::2, 1::2] = np.clip(np.rint(centre), 0, 255)
+        if self.precision == 2:
+            return grid.reshape(height, 2, width, 2, channels).transpose(1, 3, 0, 2, 4).astype(np.uint8)
+
+        # Quarter samples average the nearest half-grid samples (rounding up, as in H.264)
+        planes = np.empty((4, 4, height - 1, width - 1, channels), dtype=np.uint8)
+        for fy in range(4):
+            rows = [fy // 2, (fy + 1) // 2]
+            for fx in range(4):
+                cols = [fx // 2, (fx + 1) // 2]
+                total = sum(grid[r::2, c::2][:height - 1, :width - 1] for r in rows for c in cols)
+                planes[fy, fx] = (total + 2) // 4
+        return planes
+
+    @staticmethod
+    def _half_samples(plane, axis):
+        """
+        Applies the six-tap filter along one axis, giving the sample halfway to the next pixel.
+
+        :param plane: float32 array.
+        :param axis: Axis to interpolate along.
+        :return: float32 array of the same shape (unrounded).
+        """
+        pad = [(2, 3) if a == axis else (0, 0) for a in range(plane.ndim)]
+        padded = np.pad(plane, pad, mode='edge')
+        n = plane.shape[axis]
+        result = np.zeros_like(plane)
+        for k, tap in enumerate(HALF_PEL_TAPS):
+            result += tap * np.take(padded, np.arange(k, k + n), axis=axis)
+        return result
+
+    def predict_blocks(self, reference_frame, block_y, block_x, vectors, block_size):
+        """
+        Gathers motion-compensated blocks from the cached phase planes.
+
+        :param reference_frame: Reference frame (H x W or H x W x C).
+        :param block_y: Top row of every block (n,).
+        :param block_x: Left column of every block (n,).
+        :param vectors: (n, 2) integer (dy, dx) vectors in units of 1 / precision pixels.
+        :param block_size: Block size.
+        :return: uint8 array (n, C, block_size, block_size).
+        """
+        planes = self.planes(reference_frame)
+        positions = self.positions(planes, block_y, block_x, vectors, block_size)
+        return self.gather(planes, *positions, block_size)
+
+    def positions(self, planes, block_y, block_x, vectors, block_size):
+        """
+        Converts block positions and fractional vectors to phase-plane indices.
+
+        :param planes: Phase planes returned by planes().
+        :param block_y: Top row of every block (n,).
+        :param block_x: Left column of every block (n,).
+        :param vectors: (n, 2) integer (dy, dx) vectors in units of 1 / precision pixels.
+        :param block_size: Block size.
+        :return: Tuple (phase_y, phase_x, y, x) of (n,) index arrays.
+        """
+        p = self.precision
+        vectors = np.asarray(vectors, dtype=np.int64).reshape(-1, 2)
+        max_y, max_x = planes.shape[2] - block_size, planes.shape[3] - block_size
+        y = np.clip(np.asarray(block_y) + self.margin + np.floor_divide(vectors[:, 0], p), 0, max_y)
+        x = np.clip(np.asarray(block_x) + self.margin + np.floor_divide(vectors[:, 1], p), 0, max_x)
+        return vectors[:, 0] % p, vectors[:, 1] % p, y, x
+
+    @staticmethod
+    def gather(planes, phase_y, phase_x, y, x, block_size):
+        """
+        Gathers blocks from phase planes at precomputed indices.
+
+        :param planes: Phase planes (P, P, H', W', C).
+        :param phase_y: Vertical phase of every block (n,).
+        :param phase_x: Horizontal phase of every block (n,).
+        :param y: Top row of every block in the padded plane (n,).
+        :param x: Left column of every block in the padded plane (n,).
+        :param block_size: Block size.
+        :return: uint8 array (n, C, block_size, block_size).
+        """
+        windows = np.lib.stride_tricks.sliding_window_view(planes, (block_size, block_size), axis=(2, 3))
+        return windows[phase_y, phase_x, y, x]
+
+    def to_units(self, motion_vector):
+        """
+        Converts a (dx, dy) motion vector in pixels to (dy, dx) in units of 1 / precision pixels.
+
+        :param motion_vector: Tuple (dx, dy), possibly fractional.
+        :return: Tuple (dy, dx) of integers.
+        """
+        dx, dy = motion_vector
+        units = (int(round(dy * self.precision)), int(round(dx * self.precision)))
+        if units[0] != dy * self.precision or units[1] != dx * self.precision:
+            raise ValueError(f"Motion vector {motion_vector} is finer than 1/{self.precision} pixel.")
+        return units
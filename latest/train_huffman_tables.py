@@ -0,0 +1,115 @@
+# train_huffman_tables.py
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+from huffman_coder import HuffmanCoder
+from huffman_table_cache import HuffmanTableCache, DEFAULT_INTRA_TABLE, DEFAULT_INTER_TABLE
+from video_encoder import VideoEncoder
+
+# Configurations the built-in tables were trained on: both colour formats, every transform and
+# qualities 30 to 90, coded at 320x240 in GOPs of 4 frames
+DEFAULT_CONFIGURATIONS = [
+    {'color_format': color_format, 'transform_size': transform_size, 'transform': transform, 'compression_quality': quality}
+    for color_format in ('ycbcr420', 'rgb')
+    for transform_size, transform in ((8, 'dct'), (4, 'integer'), (16, 'dct'))
+    for quality in (30, 50, 75, 90)
+]
+
+
+class HuffmanTableTrainer(HuffmanTableCache):
+    def __init__(self, scale=1e6):
+        """
+        Initializes the HuffmanTableTrainer.
+
+        A HuffmanTableCache that also records the symbol statistics of every frame it chooses a
+        table for, separately for I-frames and P/B-frames. Encoding sequences with it in place
+        of the encoder's cache collects the statistics the built-in tables (DEFAULT_TABLES) are
+        trained from. The built-in tables were trained on the frames of Draft/images.zip with
+        DEFAULT_CONFIGURATIONS; savings measured on those frames are measured on training data.
+
+        :param scale: Number of symbols the accumulated histograms are scaled to.
+        """
+        super().__init__()
+        self.scale = scale
+        self.frame_type = 'I'
+        self.histograms = {DEFAULT_INTRA_TABLE: np.zeros(256), DEFAULT_INTER_TABLE: np.zeros(256)}
+
+    def start_frame(self, frame_type):
+        """
+        Applies the scope before a frame is coded and notes the frame's type.
+
+        :param frame_type: 'I', 'P' or 'B'.
+        """
+        super().start_frame(frame_type)
+        self.frame_type = frame_type
+
+    def select(self, frequencies):
+        """
+        Records the frame's symbol histogram, normalized so every frame weighs the same, and
+        chooses its table as HuffmanTableCache does.
+
+        :param frequencies: Dict symbol -> count of the frame's symbols.
+        :return: Tuple (table_id, codes), see HuffmanTableCache.select.
+        """
+        histogram = np.zeros(256)
+        histogram[list(frequencies)] = list(frequencies.values())
+        table_id = DEFAULT_INTRA_TABLE if self.frame_type == 'I' else DEFAULT_INTER_TABLE
+        self.histograms[table_id] += histogram / histogram.sum()
+        return super().select(frequencies)
+
+    def train(self, input_folder, resolution=(320, 240), gop_size=4, configurations=None):
+        """
+        Encodes the images of a folder with every configuration and records their statistics.
+
+        :param input_folder: Path to the training images.
+        :param resolution: Tuple of (width, height) the images are coded at.
+        :param gop_size: Number of frames in a GOP.
+        :param configurations: List of VideoEncoder argument dicts (defaults to DEFAULT_CONFIGURATIONS).
+        """
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            # The compressed data is written to the working directory
+            os.chdir(folder)
+            try:
+                for configuration in configurations or DEFAULT_CONFIGURATIONS:
+                    encoder = VideoEncoder(input_folder, os.path.join(folder, 'output.mp4'),
+                                           os.path.join(folder, 'metadata.json'), resolution, subpel='quarter',
+                                           gop_size=gop_size, **configuration)
+                    encoder.huffman_tables = encoder.frame_encoder.huffman_tables = self
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        encoder.encode_video()
+                    print(f"Trained on {configuration}")
+            finally:
+                os.chdir(working_directory)
+
+    def trained_tables(self):
+        """
+        Builds the built-in tables from the recorded statistics, scaled to `scale` symbols
+        (see HuffmanTableCache.complete_lengths).
+
+        :return: Dict table id -> table in HuffmanCoder.serialize_table form.
+        """
+        tables = {}
+        for table_id, histogram in self.histograms.items():
+            scaled = np.rint(histogram / histogram.sum() * self.scale)
+            frequencies = {int(symbol): int(scaled[symbol]) for symbol in np.flatnonzero(scaled)}
+            tables[table_id] = HuffmanCoder.serialize_table(self.complete_lengths(frequencies))
+        return tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trains the built-in Huffman tables of HuffmanTableCache")
+    parser.add_argument('input_folder', type=str, help='Path to the training images (e.g. Draft/images.zip extracted)')
+    parser.add_argument('--width', type=int, default=320, help='Width the images are coded at')
+    parser.add_argument('--height', type=int, default=240, help='Height the images are coded at')
+    parser.add_argument('--gop_size', type=int, default=4, help='Number of frames in a GOP')
+    args = parser.parse_args()
+
+    trainer = HuffmanTableTrainer()
+    trainer.train(args.input_folder, resolution=(args.width, args.height), gop_size=args.gop_size)
+    for table_id, data in trainer.trained_tables().items():
+        print(f"{table_id}: {data.hex()}")
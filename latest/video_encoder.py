@@ -1,5 +1,6 @@
 # video_encoder.py
 
+import base64
 import json
 import numpy as np
 import cv2
@@ -7,13 +8,21 @@ from math import ceil
 from image_processor import ImageProcessor
 from videowriter import VideoWriter
 from huffman_coder import HuffmanCoder
-from macroblock_processor import MacroblockProcessor
+from huffman_table_cache import HuffmanTableCache
 from frame_encoder import FrameEncoder  
 from motion_estimator import MotionEstimator
+from opencv_motion_estimator import OpenCVMotionEstimator
+from subpel_interpolator import SubpelInterpolator
+from color_converter import ColorConverter
+from rate_controller import RateController
 
 
 class VideoEncoder:
-    def __init__(self, input_folder, output_path, metadata_output_path, resolution, compression_quality=90, codec='h264', gop_size=10, b_frame_interval=2):
+    def __init__(self, input_folder, output_path, metadata_output_path, resolution, compression_quality=90, codec='h264', gop_size=10, b_frame_interval=2, motion_strategy='full', search_range=8, motion_predictors=False, subpel=None,
+                 motion_plane='color', motion_decimate=False, motion_workers=1, motion_parallel_backend='thread',
+                 motion_backend='numpy', global_motion=None, transform_size=8, color_format='ycbcr420',
+                 transform='dct', target_bitrate=None, byte_budget=None, adaptive_quantization=False, aq_strength=1.0,
+                 skip_threshold=1.0, huffman_tables='stream', table_drift=0.02, default_tables=True):
         """
         Initializes the VideoEncoder instance.
 
@@ -21,11 +30,43 @@ class VideoEncoder:
         :param output_path: Path to save the encoded video.
         :param metadata_output_path: Path to save metadata.
         :param resolution: Tuple of (width, height).
-        :param compression_quality: Quality factor for quantization.
+        :param compression_quality: Quality factor for quantization (1..100, scales the JPEG tables).
         :param codec: Codec to use for video encoding.
         :param gop_size: Number of frames in a Group of Pictures (GOP).
         :param b_frame_interval: Interval between B-frames.
+        :param motion_strategy: Motion search strategy ('full', 'three_step', 'diamond', 'hexagon' or 'pyramid';
+                                'full' or 'optical_flow' for the OpenCV backend).
+        :param search_range: Motion search range in pixels.
+        :param motion_predictors: Seed fast motion searches from neighbouring and previous-frame vectors.
+        :param subpel: Sub-pixel motion refinement: None, 'half' or 'quarter'.
+        :param motion_plane: Plane used for motion search: 'color' (all channels) or 'luma'.
+        :param motion_decimate: Run a 2x decimated coarse motion search before the full-resolution refinement.
+        :param motion_workers: Number of workers running the motion search on bands of macroblock rows.
+        :param motion_parallel_backend: 'thread' or 'process' pool for the motion search workers.
+        :param motion_backend: Motion estimation backend: 'numpy' (MotionEstimator) or 'opencv'
+                               (OpenCVMotionEstimator).
+        :param global_motion: Global (camera) motion pre-pass of the 'numpy' backend: None, 'translation' or 'affine'.
+        :param transform_size: DCT block size inside each 16x16 macroblock (4, 8 or 16).
+        :param color_format: 'ycbcr420' (Y plus 2x subsampled Cb/Cr; motion search runs on Y) or 'rgb'.
+        :param transform: 'dct' or 'integer' (bit-exact H.264 4x4 integer transform, needs transform_size=4).
+        :param target_bitrate: Target bitrate in bits per second. Enables rate control: the quality
+                               of every frame is chosen by a RateController, starting from
+                               compression_quality.
+        :param byte_budget: Size budget of the compressed data in bytes (rate control, instead of target_bitrate).
+        :param adaptive_quantization: Per-macroblock quantizer offsets from block activity (see FrameEncoder).
+        :param aq_strength: QP offset per doubling of a macroblock's variance.
+        :param skip_threshold: Mean absolute residual per sample up to which inter-coded
+                               macroblocks are skipped (residuals that quantize to zero always are);
+                               the mode decision skips others where that is cheaper (see FrameEncoder).
+        :param huffman_tables: How long a Huffman table built by the encoder is reused by later
+                               frames: 'frame' (never), 'gop' or 'stream' (see HuffmanTableCache).
+        :param table_drift: Relative excess bits of the best cached table over a fresh one above
+                            which a frame gets a new table.
+        :param default_tables: Start from the built-in tables, which short clips can use without
+                               sending any table.
         """
+        if target_bitrate is not None and byte_budget is not None:
+            raise ValueError("Give either a target bitrate or a byte budget, not both.")
         self.image_processor = ImageProcessor(input_folder, verbose=True)
         self.video_writer = VideoWriter(output_path, resolution, codec=codec)
         self.width, self.height = resolution
@@ -33,11 +74,34 @@ class VideoEncoder:
         self.metadata_output_path = metadata_output_path
         self.gop_size = gop_size
         self.b_frame_interval = b_frame_interval
+        self.target_bitrate = target_bitrate
+        self.byte_budget = byte_budget
 
-        # Initialize FrameEncoder
-        self.frame_encoder = FrameEncoder(block_size=16, search_range=8, compression_quality=compression_quality)
         # Initialize MotionEstimator here
-        self.motion_estimator = MotionEstimator(search_range=8, block_size=16)
+        if motion_backend == 'numpy':
+            self.motion_estimator = MotionEstimator(search_range=search_range, block_size=16, strategy=motion_strategy,
+                                                    predictors=motion_predictors, subpel=subpel,
+                                                    search_plane=motion_plane, decimate=motion_decimate,
+                                                    workers=motion_workers, parallel_backend=motion_parallel_backend,
+                                                    global_motion=global_motion)
+        elif motion_backend == 'opencv':
+            if motion_predictors or motion_decimate or global_motion:
+                raise ValueError("Motion predictors, decimation and global motion are only supported by the 'numpy' backend.")
+            self.motion_estimator = OpenCVMotionEstimator(search_range=search_range, block_size=16, strategy=motion_strategy,
+                                                          subpel=subpel, search_plane=motion_plane,
+                                                          workers=motion_workers, parallel_backend=motion_parallel_backend)
+        else:
+            raise ValueError(f"Unknown motion estimation backend '{motion_backend}'. Use 'numpy' or 'opencv'.")
+        # Huffman tables shared by the frames, referred to by id in the metadata
+        self.huffman_tables = HuffmanTableCache(huffman_tables, drift=table_drift, defaults=default_tables)
+        # Colour stage: frames are coded as plane groups (see ColorConverter)
+        self.color_converter = ColorConverter(color_format)
+        # Initialize FrameEncoder, sharing the estimator's cached sub-pixel reference planes
+        self.frame_encoder = FrameEncoder(block_size=16, search_range=search_range, compression_quality=compression_quality,
+                                          interpolator=self.motion_estimator.interpolator, transform_size=transform_size,
+                                          plane_layout=self.color_converter.layout, transform=transform,
+                                          adaptive_quantization=adaptive_quantization, aq_strength=aq_strength,
+                                          skip_threshold=skip_threshold, huffman_tables=self.huffman_tables)
 
     def pad_frame(self, frame):
         """
@@ -74,18 +138,64 @@ class VideoEncoder:
         print(f"Unpadded frame shape: {unpadded_frame.shape}")  # Debug statement
         return unpadded_frame
 
+    def frame_type(self, position):
+        """
+        Returns the type of the frame at a position in its GOP.
+
+        :param position: Index of the frame in the GOP.
+        :return: 'I', 'P' or 'B'.
+        """
+        if position == 0:
+            # I-frame
+            return 'I'
+        elif (position % (self.b_frame_interval + 1)) == 0:
+            # P-frame
+            return 'P'
+        # B-frame
+        return 'B'
+
+    def encode_planes(self, planes, prediction=None, motion_vectors=None):
+        """
+        Encodes the plane groups of a padded frame.
+
+        :param planes: Plane groups of the frame.
+        :param prediction: Motion-compensated prediction for P- and B-frames, None for I-frames.
+        :param motion_vectors: Motion vectors of the prediction, coded into the frame and weighed by the
+                               per-macroblock mode decision.
+        :return: Dict with 'encoded_data', 'codes', 'huffman_table_id' and 'reconstructed' (see FrameEncoder).
+        """
+        if prediction is None:
+            # I-frame: Encode macroblocks directly using FrameEncoder
+            return self.frame_encoder.encode_i_frame_blocks(planes)
+        return self.frame_encoder.encode_b_frame_blocks(prediction, planes, motion_vectors)
+
     def encode_video(self):
         compressed_data_list = []
-        codes_list = []
+        table_ids = []
+        new_tables = []
         frame_lengths = []
         frame_types = []
+        frame_qualities = []
+        # Skipped, intra-coded and total macroblocks of P- and B-frames
+        skipped_macroblocks = 0
+        intra_macroblocks = 0
+        inter_macroblocks = 0
 
         frames = list(self.image_processor.process_images())
         total_frames = len(frames)
         print(f"Total frames to encode: {total_frames}")
 
-        # Initialize MacroblockProcessor
-        mbp = MacroblockProcessor(block_size=16)
+        # Rate control: the quality of every frame follows the bits the previous ones produced
+        rate_controller = None
+        if self.target_bitrate is not None or self.byte_budget is not None:
+            rate_controller = RateController([self.frame_type(k % self.gop_size) for k in range(total_frames)],
+                                             target_bitrate=self.target_bitrate, byte_budget=self.byte_budget,
+                                             frame_rate=self.video_writer.frame_rate,
+                                             initial_quality=self.compression_quality)
+
+        # Temporal motion-vector predictors must not leak in from a previous sequence
+        self.motion_estimator.reset_motion_cache()
+        self.huffman_tables.reset()
 
         for i in range(0, total_frames, self.gop_size):
             gop = frames[i:i + self.gop_size]
@@ -97,22 +207,13 @@ class VideoEncoder:
 
             for j, frame in enumerate(gop):
                 frame_number = i + j + 1
-                if j == 0:
-                    # I-frame
-                    frame_type = 'I'
-                    # Resize the reference frame to (640, 480)
-                    resized_ref_frame = cv2.resize(frame, (self.width, self.height))
-                    # Pad the reference frame
-                    i_frame_reference = self.pad_frame(resized_ref_frame).copy()
-                elif (j % (self.b_frame_interval + 1)) == 0:
-                    # P-frame
-                    frame_type = 'P'
-                else:
-                    # B-frame
-                    frame_type = 'B'
-
+                frame_type = self.frame_type(j)
                 frame_types.append(frame_type)
 
+                if rate_controller is not None:
+                    self.frame_encoder.set_quality(rate_controller.frame_quality())
+                self.huffman_tables.start_frame(frame_type)
+
                 # Resize frame to (640, 480)
                 resized_frame = cv2.resize(frame, (self.width, self.height))
                 print(f"Processing frame {frame_number}: Resized shape {resized_frame.shape}")  # Debug
@@ -121,67 +222,96 @@ class VideoEncoder:
                 padded_frame = self.pad_frame(resized_frame)
                 print(f"Processing frame {frame_number}: Padded shape {padded_frame.shape}")  # Debug
 
-                # Split into macroblocks
-                macroblocks = mbp.split_into_macroblocks(padded_frame)
-                print(f"Number of macroblocks: {len(macroblocks)}")  # Debug
+                # Convert to the coded plane groups (the first is the full-resolution group)
+                planes = self.color_converter.to_planes(padded_frame)
+
+                # Macroblocks of the padded frame (transforms run on the whole frame at once)
+                block_size = self.frame_encoder.block_size
+                num_macroblocks = (planes[0].shape[0] // block_size) * (planes[0].shape[1] // block_size)
+                print(f"Number of macroblocks: {num_macroblocks}")  # Debug
 
                 # If P or B frame, estimate motion relative to I-frame reference or another reference frame
                 if frame_type in ['P', 'B'] and i_frame_reference is not None:
-                    motion_vectors = self.motion_estimator.estimate_motion(i_frame_reference, padded_frame)
+                    motion_vectors = self.motion_estimator.estimate_motion(i_frame_reference[0], planes[0])
+                    print(f"Motion search ({self.motion_estimator.stats['strategy']}): {self.motion_estimator.stats['candidates_evaluated']} candidates evaluated")  # Debug
                 else:
-                    motion_vectors = [(0, 0)] * len(macroblocks)
-
-                # Lists to store encoded macroblocks
-                encoded_macroblocks = []
-
-                # Process each macroblock
-                for idx, mb in enumerate(macroblocks):
-                    print(f"Macroblock {idx+1} shape: {mb.shape}")  # Debug
-                    if frame_type == 'I':
-                        # I-frame: Encode macroblock directly using FrameEncoder
-                        encoded_mb = self.frame_encoder.encode_i_frame(mb)
-                    else:
-                        mv = motion_vectors[idx]
-
-                        # Determine the macroblock's position
-                        blocks_per_row = self.width // self.frame_encoder.block_size
-                        row = idx // blocks_per_row
-                        col = idx % blocks_per_row
-                        y = row * self.frame_encoder.block_size
-                        x = col * self.frame_encoder.block_size
-
-                        # Apply motion vector to get reference macroblock's top-left corner
-                        ref_y = y + mv[1]
-                        ref_x = x + mv[0]
-
-                        # Ensure reference positions are within frame boundaries
-                        ref_y = min(max(ref_y, 0), self.height - self.frame_encoder.block_size)
-                        ref_x = min(max(ref_x, 0), self.width - self.frame_encoder.block_size)
-
-                        # Extract reference macroblock from i_frame_reference
-                        reference_mb = i_frame_reference[ref_y:ref_y+self.frame_encoder.block_size, ref_x:ref_x+self.frame_encoder.block_size, :]
-
-                        # Encode B-frame macroblock
-                        encoded_mb = self.frame_encoder.encode_b_frame(reference_mb, mb, mv)
-
-                    encoded_macroblocks.append(encoded_mb)
-
-                # Combine encoded macroblocks into one bitstring
-                encoded_data = ''.join(encoded_macroblocks)
-                compressed_data_list.append(encoded_data)
-                codes_list.append({})  # Placeholder: Store Huffman codes if needed
-                frame_lengths.append(len(encoded_data))
+                    motion_vectors = [(0, 0)] * num_macroblocks
+
+                # Encode all macroblocks of the frame at once
+                prediction = None
+                if frame_type != 'I':
+                    # Motion-compensated prediction from i_frame_reference (vectors may be fractional)
+                    prediction = self.frame_encoder.predict_frame(i_frame_reference, motion_vectors)
+                # The motion vectors are coded into the frame's bits
+                encoded = self.encode_planes(planes, prediction, motion_vectors)
+                if rate_controller is not None:
+                    # Frames are stored byte-aligned
+                    bits = len(encoded['encoded_data']) * 8
+                    codings = {self.frame_encoder.compression_quality: (encoded, self.frame_encoder.stats)}
+                    probes = [(self.frame_encoder.compression_quality, bits)]
+                    quality = rate_controller.probe_quality(probes)
+                    while quality is not None:
+                        # Missed the budget: code the frame again and keep the coding closest to it
+                        self.frame_encoder.set_quality(quality)
+                        retry = self.encode_planes(planes, prediction, motion_vectors)
+                        codings[quality] = (retry, self.frame_encoder.stats)
+                        probes.append((quality, len(retry['encoded_data']) * 8))
+                        quality = rate_controller.probe_quality(probes)
+                    quality, bits = rate_controller.closest(probes)
+                    encoded, self.frame_encoder.stats = codings[quality]
+                    self.frame_encoder.set_quality(quality)
+                    rate_controller.update(quality, bits, probes)
+                if frame_type == 'I':
+                    # Predict from the reconstructed I-frame, exactly as the decoder will
+                    i_frame_reference = encoded['reconstructed']
+                else:
+                    stats = self.frame_encoder.stats
+                    skipped_macroblocks += stats['skipped']
+                    intra_macroblocks += stats['intra']
+                    inter_macroblocks += stats['macroblocks']
+                    print(f"Modes of {stats['macroblocks']} macroblocks: {stats['skipped']} skipped, "
+                          f"{stats['intra']} intra, {stats['macroblocks'] - stats['skipped'] - stats['intra']} inter")  # Debug
+
+                # The first frame coded with a new Huffman table carries it; later frames refer to its id
+                table_id = encoded['huffman_table_id']
+                new_table = None
+                if table_id is not None and table_id not in self.huffman_tables.tables:
+                    self.huffman_tables.add(table_id, {symbol: len(code) for symbol, code in encoded['codes'].items()})
+                    new_table = self.huffman_tables.serialize(table_id)
+                table_ids.append(table_id)
+                new_tables.append(new_table)
+
+                # Zigzag/run-length coded coefficients of the frame
+                compressed_data_list.append(encoded['encoded_data'])
+                frame_lengths.append(encoded['length'])
+                frame_qualities.append(self.frame_encoder.compression_quality)
 
                 print(f"Encoded frame {frame_number} as {frame_type}-frame.")
 
+        self.motion_estimator.close()
+
         # Save compressed data
         with open('compressed_data.bin', 'wb') as f:
             for data in compressed_data_list:
-                if len(data) % 8 != 0:
-                    data = data.ljust(len(data) + (8 - len(data) % 8), '0')  # Pad with zeros to make it byte-aligned
-                byte_data = int(data, 2).to_bytes(len(data) // 8, byteorder='big')
-                f.write(byte_data)
-                print(f"Written {len(byte_data)} bytes of compressed data.")  # Debug statement
+                # Frames are byte-aligned: the last byte of each is padded with zero bits
+                f.write(data)
+                print(f"Written {len(data)} bytes of compressed data.")  # Debug statement
+
+        # Achieved bitrate of the stored (byte-aligned) frames
+        total_bits = 8 * sum(len(data) for data in compressed_data_list)
+        self.achieved_bitrate = total_bits * self.video_writer.frame_rate / max(total_frames, 1)
+        print(f"Achieved bitrate: {self.achieved_bitrate / 1000:.1f} kbit/s ({total_bits // 8} bytes)")
+        self.skip_rate = skipped_macroblocks / inter_macroblocks if inter_macroblocks else 0.0
+        print(f"Skip rate: {self.skip_rate:.1%} of P/B-frame macroblocks ({skipped_macroblocks} of {inter_macroblocks})")
+        self.intra_rate = intra_macroblocks / inter_macroblocks if inter_macroblocks else 0.0
+        print(f"Intra rate: {self.intra_rate:.1%} of P/B-frame macroblocks ({intra_macroblocks} of {inter_macroblocks})")
+        sent_tables = [table for table in new_tables if table is not None]
+        print(f"Huffman tables: {len(sent_tables)} sent ({sum(len(table) for table in sent_tables)} bytes) "
+              f"for {total_frames} frames, {self.huffman_tables.scope} scope")
+        if rate_controller is not None:
+            report = rate_controller.report()
+            print(f"Rate control target: {report['target_bitrate'] / 1000:.1f} kbit/s ({report['target_bits'] // 8} bytes), "
+                  f"frame qualities {frame_qualities}")
 
         # Save metadata
         metadata = {
@@ -189,18 +319,31 @@ class VideoEncoder:
             'resolution': (self.width, self.height),
             'frame_rate': self.video_writer.frame_rate,
             'compression_quality': self.compression_quality,
+            'transform_size': self.frame_encoder.transform_size,
+            'transform': self.frame_encoder.transform,
+            'adaptive_quantization': self.frame_encoder.adaptive_quantization,
+            'color_format': self.color_converter.color_format,
             'gop_size': self.gop_size,
             'b_frame_interval': self.b_frame_interval,
+            'motion_vector_precision': self.motion_estimator.interpolator.precision,
+            'achieved_bitrate': self.achieved_bitrate,
+            'skip_rate': self.skip_rate,
+            'intra_rate': self.intra_rate,
             'frames': []
         }
 
-        for frame_idx, (frame_type, codes, length) in enumerate(zip(frame_types, codes_list, frame_lengths), start=1):
+        for frame_idx, (frame_type, quality, table_id, table, length) in enumerate(
+                zip(frame_types, frame_qualities, table_ids, new_tables, frame_lengths), start=1):
             frame_metadata = {
                 'frame_number': frame_idx,
                 'frame_type': frame_type,
-                'codes': codes,
+                'quality': quality,
+                'huffman_table_id': table_id,
                 'length': length
             }
+            if table is not None:
+                # Canonical Huffman table: code counts per length and one byte per symbol
+                frame_metadata['huffman_table'] = base64.b64encode(table).decode('ascii')
             metadata['frames'].append(frame_metadata)
 
         with open(self.metadata_output_path, 'w') as f:
@@ -219,17 +362,36 @@ class VideoEncoder:
         frames_metadata = metadata['frames']
         width, height = metadata['resolution']
         compression_quality = metadata['compression_quality']
+        transform_size = metadata['transform_size']
+        transform = metadata['transform']
+        self.color_converter = ColorConverter(metadata['color_format'])
+        if (compression_quality, transform_size, transform, self.color_converter.layout) != \
+                (self.frame_encoder.compression_quality, self.frame_encoder.transform_size, self.frame_encoder.transform,
+                 self.frame_encoder.plane_layout):
+            self.frame_encoder = FrameEncoder(block_size=self.frame_encoder.block_size, search_range=self.frame_encoder.search_range,
+                                              compression_quality=compression_quality, interpolator=self.frame_encoder.interpolator,
+                                              transform_size=transform_size, plane_layout=self.color_converter.layout,
+                                              transform=transform)
+        # Frames carry their quantizer offsets ahead of the coefficients
+        self.frame_encoder.adaptive_quantization = metadata['adaptive_quantization']
+        precision = metadata['motion_vector_precision']
+        if self.frame_encoder.interpolator.precision < precision:
+            self.frame_encoder.interpolator = SubpelInterpolator(precision=precision)
 
         # Load compressed data
         with open('compressed_data.bin', 'rb') as f:
             compressed_data_bytes = f.read()
 
-        # Convert bytes back to bitstring
-        compressed_bitstring = ''.join(f'{byte:08b}' for byte in compressed_data_bytes)
-        print(f"Total bits loaded: {len(compressed_bitstring)}")  # Debug
+        print(f"Total bytes loaded: {len(compressed_data_bytes)}")  # Debug
+
+        # Plane group shapes of the padded frames
+        block_size = self.frame_encoder.block_size
+        padded_height, padded_width = -(-height // block_size) * block_size, -(-width // block_size) * block_size
+        shapes = [(padded_height // subsampling, padded_width // subsampling, len(kinds))
+                  for subsampling, kinds in self.color_converter.layout]
 
-        # Initialize MacroblockProcessor
-        mbp = MacroblockProcessor(block_size=16)
+        # Built-in tables plus every table a frame has carried so far
+        huffman_tables = HuffmanTableCache(size=None)
 
         decoded_frames = []
         idx = 0
@@ -238,42 +400,43 @@ class VideoEncoder:
         for frame_info in frames_metadata:
             frame_number = frame_info['frame_number']
             frame_type = frame_info['frame_type']
-            codes = frame_info['codes']
+            table_id = frame_info['huffman_table_id']
+            if 'huffman_table' in frame_info:
+                huffman_tables.add(table_id, HuffmanCoder.deserialize_table(base64.b64decode(frame_info['huffman_table'])))
+            # A frame without coefficients has no table
+            codes = huffman_tables.decoding_table(table_id) if table_id is not None else {}
             frame_bits_length = frame_info['length']
+            # Rate control may change the quality from frame to frame
+            self.frame_encoder.set_quality(frame_info['quality'])
 
-            frame_bits = compressed_bitstring[idx:idx + frame_bits_length]
-            idx += frame_bits_length
-            print(f"Decoding frame {frame_number}: {len(frame_bits)} bits")  # Debug
+            # Every frame is padded to a whole byte
+            frame_bytes = -(-frame_bits_length // 8)
+            frame_data = compressed_data_bytes[idx:idx + frame_bytes]
+            idx += frame_bytes
+            print(f"Decoding frame {frame_number}: {frame_bits_length} bits")  # Debug
 
             if frame_type == 'I':
-                # Decode I-frame
-                reconstructed_mbs = self.frame_encoder.decode_i_frame(frame_bits)
-                if reconstructed_mbs is None:
-                    print(f"Frame {frame_number} I-frame decoding failed.")
-                    continue
-                # Reconstruct frame from macroblocks
-                frame = mbp.reconstruct_frame(reconstructed_mbs, width, height)
+                # Decode all macroblocks of the I-frame at once
+                planes = self.frame_encoder.decode_i_frame_blocks(frame_data, codes, shapes)
+                # Keep the padded plane groups as reference, matching the encoder's predictions
+                i_frame_reference = planes
+                frame = self.color_converter.to_frame(planes)
                 # Remove padding if any
                 unpadded_frame = self.unpad_frame(frame)
-                i_frame_reference = unpadded_frame.copy()
                 decoded_frames.append(unpadded_frame)
                 print(f"Decoded and unpadded frame {frame_number} as I-frame.")
-            elif frame_type == 'B':
-                # Decode B-frame using the latest I-frame reference
-                reconstructed_mbs = self.frame_encoder.decode_b_frame(i_frame_reference, frame_bits)
-                if reconstructed_mbs is None:
-                    print(f"Frame {frame_number} B-frame decoding failed.")
+            elif frame_type in ['P', 'B']:
+                # P- and B-frames are both predicted from the latest I-frame reference
+                if i_frame_reference is None:
+                    print(f"Frame {frame_number} {frame_type}-frame has no reference frame.")
                     continue
-                frame = mbp.reconstruct_frame(reconstructed_mbs, width, height)
+                # The motion vectors are read from the frame's bits
+                planes = self.frame_encoder.decode_b_frame_blocks(None, frame_data, codes, reference=i_frame_reference)
+                frame = self.color_converter.to_frame(planes)
                 # Remove padding if any
                 unpadded_frame = self.unpad_frame(frame)
                 decoded_frames.append(unpadded_frame)
-                print(f"Decoded and unpadded frame {frame_number} as B-frame.")
-            elif frame_type == 'P':
-                # Decode P-frame (similar to I-frame but using prediction)
-                # Implement decode_p_frame if needed
-                print(f"Frame {frame_number} is a P-frame. Decoding not implemented.")
-                continue
+                print(f"Decoded and unpadded frame {frame_number} as {frame_type}-frame.")
             else:
                 print(f"Frame {frame_number} has an unknown frame type: {frame_type}")
                 continue